@@ -7,80 +7,151 @@ from math import radians
 from mathutils import Vector
 from bpy_extras.object_utils import world_to_camera_view
 import datetime
+from itertools import islice
+import socket
+import sys
+import threading
+import time
+import numpy as np
+
+# Make the helper modules next to this script importable from Blender
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+
+from projection import project_vertices, render_size
+from vertex_groups import VertexGroupIndex
+from visibility import enable_depth_pass, read_depth_buffer, depth_visibility, classify_visibility, find_occluders, in_frustum, connect_viewer, read_viewer_pixels
+from annotation_store import AnnotationStore
+from shards import ShardWriter
+from hdri import HDRIManager, HDRIPrefetcher
+from view_plan import ViewPlan, CompletionJournal, make_view, find_latest_run
+from job_queue import JobQueue, LeaseHeartbeat, QueueJournal
+from output_pipeline import OutputPipeline, encode_png
+from render_trace import RunTrace, ViewTrace
+from animation_batch import bake_camera_keyframes, frame_handlers, animation_render_settings
+from viewpoints import sample_viewpoints, angular_coverage
+from view_gate import ViewGate, estimate_view_quality
+from subject_cache import SubjectCache
+from catalog import Catalog, annotation_counts
+from render_region import region_of_interest, region_pixels, render_border, set_render_border
+from scene_state import SceneState
 
 # Constants
 HEMISPHERE_MESH_NAME = "Hemisphere"
 TARGET_OBJECT_NAME = "HG_Body"
 CAMERA_NAME = "Render_Camera"
 VERTEX_GROUP_NAME = "Head"
-OUTPUT_DIR = r'C:\Desktop\SDPL\generated_data\Abby'
+# Set to a list of groups (e.g. ["Head", "Hand_L", "Hand_R"]) to annotate all of them in one pass instead of
+# VERTEX_GROUP_NAME alone. Outputs get a group mask column where bit k marks VERTEX_GROUP_NAMES[k].
+VERTEX_GROUP_NAMES = None
+SUBJECT_DIR = r'C:\Desktop\SDPL\generated_data\Abby'
+# Set RUN_NAME to an existing run folder (e.g. '202405070214') or 'latest' to resume it
+RUN_NAME = None
+if RUN_NAME == 'latest':
+    RUN_NAME = find_latest_run(SUBJECT_DIR)
 timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M")
-OUTPUT_DIR = os.path.join(OUTPUT_DIR, timestamp)
+OUTPUT_DIR = os.path.join(SUBJECT_DIR, RUN_NAME or timestamp)
 HDRI_DIR = r'C:\Desktop\SDPL\hdris'
 NUM_RANDOM_VERTICES = 30
-CACHE_FILE = os.path.join(OUTPUT_DIR, 'render_cache.txt')
+# 'fibonacci' spreads the views evenly over the patch below, 'farthest' picks them by farthest point
+# sampling, 'hemisphere' samples random vertices of the HEMISPHERE_MESH_NAME object like before
+VIEWPOINT_MODE = 'fibonacci'
+# Camera distance and angles around the 3D cursor, as in Camera.set_random_view_from_cursor (camera_panning.py)
+VIEWPOINT_RADIUS_RANGE = (1.5, 3.0)
+VIEWPOINT_THETA_RANGE = (radians(85), radians(92.8))
+VIEWPOINT_PHI_RANGE = (radians(106), radians(148.45))
+# Part of the patch within this angle of a view counts as covered
+VIEWPOINT_COVERAGE_ANGLE = radians(2)
+# Candidate poses that frame less than this part of the vertex group, or see less than this part of it
+# from the front, are replaced before the plan is saved. Set both to 0 to keep every candidate.
+VIEW_GATE_MIN_IN_FRAME = 0.5
+VIEW_GATE_MIN_VISIBLE = 0.25
+# Give up looking for acceptable poses after this many candidates
+VIEW_GATE_MAX_CANDIDATES = 20 * NUM_RANDOM_VERTICES
+# Seed of the view plan, None draws a fresh one. The seed is stored in the plan.
+PLAN_SEED = None
+# 'raycast' casts one ray per vertex, 'depth' compares against the rendered Z pass,
+# 'tiered' runs frustum and backface tests first and only ray casts what is left
+VISIBILITY_MODE = 'raycast'
+DEPTH_TOLERANCE = 0.01
+# A ray cast hit closer than this to the vertex still counts as visible ('raycast' and 'tiered')
+VISIBILITY_TOLERANCE = 0.01
+# Annotate the evaluated (posed, modified) subject mesh and keep its world space vertices between views
+# until its matrices, armature pose or modifiers change. False reads the rest mesh for every view.
+SUBJECT_CACHE = True
+BACKFACE_THRESHOLD = 0.1
+# Objects that can hide the target vertices in 'tiered' mode (hair, clothes, ...)
+OCCLUDER_NAMES = [TARGET_OBJECT_NAME]
+# 'csv' writes view_###.csv files, 'columnar' appends typed arrays to OUTPUT_DIR/annotations,
+# 'shards' streams images, annotations and metadata into tar shards in OUTPUT_DIR/shards
+ANNOTATION_FORMAT = 'csv'
+MAX_SHARD_BYTES = 512 * 1024 * 1024
+# Every written view gets a row in this SQLite catalog (see catalog.py), None turns it off
+CATALOG_DB = os.path.join(os.path.dirname(SUBJECT_DIR), 'catalog.sqlite')
+# Subject and run the catalog rows are filed under, None uses the names of SUBJECT_DIR and OUTPUT_DIR
+CATALOG_SUBJECT = None
+CATALOG_RUN = None
+BACKGROUND_STRENGTH_RANGE = (0.12, 1)
+# Loaded HDRIs are kept in memory up to this many bytes
+HDRI_MEMORY_BUDGET = 2 * 1024 ** 3
+HDRI_MANAGERS = {}
+# Number of upcoming views whose HDRI files are read ahead on a background thread
+HDRI_PREFETCH_AHEAD = 2
+# Set QUEUE_DB to a SQLite file on a shared drive to render as one of several queue workers.
+# Every node must use the same RUN_NAME and PLAN_SEED so they draw the same plan.
+QUEUE_DB = None
+QUEUE_BATCH_SIZE = 2
+QUEUE_LEASE_SECONDS = 900
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_POLL_SECONDS = 30
+# Number of writer threads that write a view's outputs while the next view renders, 0 writes them inline
+PIPELINE_WRITERS = 0
+# Rendered views that may wait for the writers before the render loop blocks
+PIPELINE_MAX_PENDING = 4
+# Read the render from a Viewer node and encode the PNG on the writer threads instead of in Blender.
+# This switches to the 'Standard' view transform and can't be combined with VISIBILITY_MODE = 'depth'.
+PIPELINE_CAPTURE_PIXELS = False
+# 'stills' renders each view on its own, 'animation' bakes the pending views into camera keyframes
+# and renders them as one animation job with persistent data (no VISIBILITY_MODE 'depth' or pixel capture)
+RENDER_MODE = 'stills'
+# Render only a render border around the vertex groups, grown by ROI_MARGIN times its size on every side
+# and at least ROI_MIN_SIZE pixels ('stills' mode only). With ROI_CROP the images are cropped to the border
+# and the annotations shifted to match (no VISIBILITY_MODE 'depth'), otherwise they keep the full frame.
+ROI_RENDER = False
+ROI_MARGIN = 0.1
+ROI_MIN_SIZE = 64
+ROI_CROP = False
+# Only write the camera, HDRI, strength and render border when they differ from the previous view, so
+# unchanged datablocks aren't tagged for depsgraph updates and Cycles resyncs. False writes them all every view.
+SCENE_DELTAS = True
 
 # Functions
-def set_random_hdri(hdri_directory):
-    """Set a random HDRI from a specified directory as the world background."""
-    if not os.path.exists(hdri_directory) or not os.path.isdir(hdri_directory):
-        raise ValueError(f"Invalid directory: {hdri_directory}")
-
-    # Filter for HDRI files (assuming HDRIs are in EXR, HDR, or other standard formats)
-    valid_extensions = {'.hdr', '.exr', '.png'}
-    hdri_files = [f for f in os.listdir(hdri_directory) if os.path.splitext(f)[1].lower() in valid_extensions]
-
-    if not hdri_files:
-        raise ValueError(f"No valid HDRI files found in directory: {hdri_directory}")
-
-    # Select a random HDRI file
-    selected_hdri = random.choice(hdri_files)
-    hdri_path = os.path.join(hdri_directory, selected_hdri)
-
-    # Enable 'Use Nodes' for the World
-    world = bpy.context.scene.world
-    if not world.use_nodes:
-        world.use_nodes = True
-
-    # Set up the HDRI as the world background
-    nodes = world.node_tree.nodes
-    links = world.node_tree.links
-
-    # Clear existing nodes except the output node
-    for node in nodes:
-        if node.type != 'OUTPUT_WORLD':
-            nodes.remove(node)
-
-    # Add new Environment Texture node
-    env_tex_node = nodes.new(type='ShaderNodeTexEnvironment')
-    env_tex_node.image = bpy.data.images.load(hdri_path)
-    env_tex_node.location = (-300, 0)
-
-    # Find the World Output node and add Background node
-    output_node = next(node for node in nodes if node.type == 'OUTPUT_WORLD')
-    background_node = nodes.new(type='ShaderNodeBackground')
-    background_node.location = (-150, 0)
-    
-    background_strength = random.uniform(0.12, 1)
-    background_node.inputs[1].default_value = background_strength
-    # Link nodes
-    links.new(env_tex_node.outputs['Color'], background_node.inputs['Color'])
-    links.new(background_node.outputs['Background'], output_node.inputs['Surface'])
-
-    print(f"Applied HDRI: {hdri_path}, strength: {background_strength}")
+def get_hdri_manager(hdri_directory):
+    """Return the HDRIManager of a directory, creating it on first use."""
+    # The directory scan, world nodes and loaded images are kept between views
+    hdri_manager = HDRI_MANAGERS.get(hdri_directory)
+    if hdri_manager is None:
+        hdri_manager = HDRIManager(hdri_directory, HDRI_MEMORY_BUDGET)
+        HDRI_MANAGERS[hdri_directory] = hdri_manager
+    return hdri_manager
 
 def add_camera(location, rotation):
     """Add a camera at a specified location and rotation."""
     bpy.ops.object.camera_add(location=location, rotation=rotation)
     return bpy.context.object
 
-def look_at(obj, target):
-    """Make an object look at a specific target point with a baseline X rotation of 90 degrees."""
-    direction = target - obj.location
+def look_at_rotation(location, target):
+    """Return the Euler rotation that points a camera at location towards target."""
+    direction = target - location
     rot_quat = direction.to_track_quat('-Z', 'Y')
     adjusted_rotation = rot_quat.to_euler()
     adjusted_rotation.x += radians(0)  # Add 90 degrees to the X rotation
-    obj.rotation_euler = adjusted_rotation
+    return adjusted_rotation
+
+def look_at(obj, target):
+    """Make an object look at a specific target point with a baseline X rotation of 90 degrees."""
+    obj.rotation_euler = look_at_rotation(obj.location, target)
 
 def get_vertices_from_mesh(mesh_obj):
     """Extract vertices from a mesh object."""
@@ -107,78 +178,702 @@ def world_space_to_screen_space(camera_name, world_point):
     )
     return (co_2d.x * render_size[0], (1 - co_2d.y) * render_size[1])
 
-def vertex_visibility(scene, cam, mesh_obj, vertex):
-    """Check if a vertex is visible from the camera."""
-    mat_world = mesh_obj.matrix_world
-    co_world = mat_world @ vertex.co
+def vertex_visibility(scene, cam, mesh_obj, vertex, depsgraph=None):
+    """Check if a vertex is visible from the camera. Pass depsgraph when testing many vertices."""
+    return point_visibility(scene, cam, mesh_obj.matrix_world @ vertex.co, depsgraph)
+
+def point_visibility(scene, cam, co_world, depsgraph=None):
+    """Check if a world space point on the rendered surface is visible from the camera, see vertex_visibility."""
     co_ndc = world_to_camera_view(scene, cam, co_world)
 
     if not (0.0 < co_ndc.x < 1.0 and 0.0 < co_ndc.y < 1.0 and cam.data.clip_start < co_ndc.z < cam.data.clip_end):
         return False
 
-    direction = (co_world - cam.location).normalized()
-    depsgraph = bpy.context.evaluated_depsgraph_get()
-    result, location, _, _, _, _ = scene.ray_cast(depsgraph, cam.location, direction)
-
-    return not result or (location - co_world).length < 0.01
-
-def write_vertices_to_csv(mesh_obj, vertex_group_name, camera_name, file_path):
-    """Write vertices data to a CSV file."""
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    return ray_visibility(scene, cam.location, co_world, depsgraph)
+
+def ray_visibility(scene, origin, co_world, depsgraph):
+    """Cast a ray from origin towards a world space point and check that nothing closer is hit."""
+    direction = (co_world - origin).normalized()
+    result, location, _, _, _, _ = scene.ray_cast(depsgraph, origin, direction)
+    return not result or (location - co_world).length < VISIBILITY_TOLERANCE
+
+def group_names_of(vertex_group_name):
+    """Return the group names to annotate, vertex_group_name can be one name or a list of names."""
+    return list(vertex_group_name) if isinstance(vertex_group_name, (list, tuple)) else [vertex_group_name]
+
+def annotate_vertices(mesh_obj, vertex_group_name, camera_obj, group_index=None, depth=None, view_name='', trace=None):
+    """Project the group vertices and test their visibility for the current view.
+
+    Returns (indices, world_cos, screen_positions, visibility) arrays, or None if the mesh or group is invalid.
+    Pass a prebuilt VertexGroupIndex as group_index to skip scanning every vertex for group membership.
+    Pass the rendered depth buffer as depth to test visibility against it instead of ray casting.
+    Stage timings and vertex / ray cast counts are added to trace if given.
+    """
+    result = annotate_vertex_groups(mesh_obj, [vertex_group_name], camera_obj, group_index, depth, view_name, trace)
+    return None if result is None else result[0]
+
+def annotate_vertex_groups(mesh_obj, group_names, camera_obj, group_index=None, depth=None, view_name='', trace=None,
+                           subject_cache=None):
+    """Annotate the union of several vertex groups in one pass, see annotate_vertices.
+
+    Each vertex is projected and tested for visibility once, however many of
+    the groups it belongs to. Returns (annotation, group_mask), where bit k of
+    group_mask marks the vertices in group_names[k], or None if the mesh or a group is invalid.
+    With a SubjectCache, the world space positions and normals of the evaluated mesh come from it.
+    """
     scene = bpy.context.scene
-    camera_obj = bpy.data.objects.get(camera_name)
+    if trace is None:
+        trace = ViewTrace(view_name)
+
+    if not (isinstance(mesh_obj, bpy.types.Object) and mesh_obj.type == 'MESH'):
+        print("Error: Provided mesh object is not a valid mesh")
+        return None
 
+    for vertex_group_name in group_names:
+        if vertex_group_name not in mesh_obj.vertex_groups:
+            print(f"Error: Vertex group '{vertex_group_name}' not found in mesh '{mesh_obj.name}'")
+            return None
+
+    if group_index is None:
+        group_index = VertexGroupIndex.from_mesh(mesh_obj)
+    indices, group_mask = group_index.union(group_names)
+
+    trace.count('vertices', len(indices))
+
+    world_cos = normals = None
+    if subject_cache is not None:
+        with trace.span('subject_cache'):
+            misses = subject_cache.misses
+            all_world_cos, all_normals = subject_cache.get()
+            world_cos, normals = all_world_cos[indices], all_normals[indices]
+        trace.count('subject_cache_misses' if subject_cache.misses > misses else 'subject_cache_hits')
+
+    # Project every group vertex in one call instead of once per vertex
+    with trace.span('projection'):
+        world_cos, screen_positions, co_ndc = project_vertices(scene, camera_obj, mesh_obj, indices, world_cos)
+
+    with trace.span('visibility'):
+        if depth is not None:
+            visibility = depth_visibility(co_ndc, depth, camera_obj.data.clip_start, camera_obj.data.clip_end, DEPTH_TOLERANCE)
+        elif VISIBILITY_MODE == 'tiered':
+            occluders = find_occluders(OCCLUDER_NAMES)
+            visibility, stats = classify_visibility(camera_obj, mesh_obj, indices, world_cos, co_ndc, occluders,
+                                                    backface_threshold=BACKFACE_THRESHOLD, hit_tolerance=VISIBILITY_TOLERANCE,
+                                                    normals=normals)
+            trace.count('ray_casts', stats['ray_casts'])
+            print(f"Visibility stages for {view_name}: {stats}")
+        else:
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            # The batched projection already tells which vertices are in frame, only those need a ray
+            visibility = in_frustum(co_ndc, camera_obj.data.clip_start, camera_obj.data.clip_end)
+            framed = np.flatnonzero(visibility)
+            origin = camera_obj.location.copy()
+            # Cast at the projected positions, which are on the evaluated mesh when the subject cache is used
+            for i, co in zip(framed.tolist(), world_cos[framed].tolist()):
+                visibility[i] = ray_visibility(scene, origin, Vector(co), depsgraph)
+            trace.count('ray_casts', len(framed))
+    trace.count('visible', int(visibility.sum()))
+
+    return (indices, world_cos, screen_positions, visibility), group_mask
+
+def write_annotation_csv(file_path, annotation, width, height, group_mask=None):
+    """Write annotation arrays to a CSV file. Only plain data is used, so this can run on a writer thread.
+
+    With a group_mask (multi-group annotation), a 'Group Mask' column is added.
+    """
     with open(file_path, 'w', newline='') as csvfile:
         csvwriter = csv.writer(csvfile)
-        csvwriter.writerow(['Vertex Index', 'World X', 'World Y', 'World Z', 'Screen X', 'Screen Y', 'Visible', 'Width', 'Height', 'ScaleX', 'ScaleY'])
+        header = ['Vertex Index', 'World X', 'World Y', 'World Z', 'Screen X', 'Screen Y', 'Visible', 'Width', 'Height', 'ScaleX', 'ScaleY']
+        csvwriter.writerow(header + ['Group Mask'] if group_mask is not None else header)
 
-        if isinstance(mesh_obj, bpy.types.Object) and mesh_obj.type == 'MESH':
-            mesh_data = mesh_obj.data
-        else:
-            print("Error: Provided mesh object is not a valid mesh")
+        if annotation is None:
             return
+        indices, world_cos, screen_positions, visibility = annotation
+        masks = group_mask.tolist() if group_mask is not None else None
 
-        if vertex_group_name not in mesh_obj.vertex_groups:
-            print(f"Error: Vertex group '{vertex_group_name}' not found in mesh '{mesh_obj.name}'")
-            return
+        for row, (i, world_co, screen_pos, visible) in enumerate(zip(indices.tolist(), world_cos.tolist(), screen_positions.tolist(), visibility.tolist())):
+            visibility_text = 'Yes' if visible else 'No'
 
-        vertex_group = mesh_obj.vertex_groups[vertex_group_name]
+            values = [i, world_co[0], world_co[1], world_co[2], screen_pos[0], screen_pos[1], visibility_text, width, height, 1.0, 1.0]
+            csvwriter.writerow(values + [masks[row]] if masks is not None else values)
 
-        for i, vert in enumerate(mesh_data.vertices):
-            for group in vert.groups:
-                if group.group == vertex_group.index:
-                    world_co = mesh_obj.matrix_world @ vert.co
-                    screen_pos = world_space_to_screen_space(camera_name, world_co)
-                    visible = vertex_visibility(scene, camera_obj, mesh_obj, vert)
-                    visibility_text = 'Yes' if visible else 'No'
+            if i % 1000 == 0:
+                print(f"Vertex {i}: ({world_co[0]}, {world_co[1]}, {world_co[2]})")
 
-                    csvwriter.writerow([i, world_co.x, world_co.y, world_co.z, screen_pos[0], screen_pos[1], visibility_text, scene.render.resolution_x, scene.render.resolution_y, 1.0, 1.0])
+def crop_annotation(annotation, roi):
+    """Move screen positions into the pixels of an image cropped to the roi box. Returns (annotation, width, height)."""
+    x_min, y_min, x_max, y_max = roi
+    if annotation is not None:
+        indices, world_cos, screen_positions, visibility = annotation
+        annotation = (indices, world_cos, screen_positions - np.array([x_min, y_min]), visibility)
+    return annotation, x_max - x_min, y_max - y_min
 
-                    if i % 1000 == 0:
-                        print(f"Vertex {i}: ({world_co.x}, {world_co.y}, {world_co.z})")
+def capture_view(view, camera, target_obj, vertex_group_name, group_index, output_image, trace, subject_cache=None, roi=None):
+    """Collect everything the output stage needs from the view that was just rendered, as plain data.
 
-def render_camera_from_vertices(camera, vertices, cursor_location, mesh_obj, vertex_group_name, target_obj, start_index=0):
-    """Render views from the vertices on the mesh and save each with corresponding CSV."""
-    for index in range(start_index, len(vertices)):
-        set_random_hdri(HDRI_DIR)
-        camera.location = vertices[index]
-        look_at(camera, cursor_location)
+    roi is the pixel box rendered with ROI_RENDER. With ROI_CROP, screen
+    positions and image size are those of the cropped image.
+    """
+    scene = bpy.context.scene
+    with trace.span('read_depth'):
+        depth = read_depth_buffer() if VISIBILITY_MODE == 'depth' else None
+    group_names = group_names_of(vertex_group_name)
+    result = annotate_vertex_groups(target_obj, group_names, camera, group_index, depth, view['name'], trace, subject_cache)
+    annotation, group_mask = result if result is not None else (None, None)
+    with trace.span('read_pixels'):
+        pixels = read_viewer_pixels().copy() if PIPELINE_CAPTURE_PIXELS else None
+
+    width, height = scene.render.resolution_x, scene.render.resolution_y
+    if roi is not None and ROI_CROP:
+        annotation, width, height = crop_annotation(annotation, roi)
+    return {
+        'view': view,
+        'trace': trace,
+        'annotation': annotation,
+        # Only multi-group annotations carry a mask, single group outputs keep their old layout
+        'group_mask': group_mask if len(group_names) > 1 else None,
+        'pixels': pixels,
+        'image_path': output_image,
+        'width': width,
+        'height': height,
+        'metadata': {
+            'view': view['name'],
+            'vertex_group': vertex_group_name,
+            'vertex_groups': group_names,
+            'camera_location': list(camera.location),
+            'camera_rotation': list(camera.rotation_euler),
+            'hdri': view['hdri'],
+            'background_strength': view['strength'],
+            'width': width,
+            'height': height,
+            # Pixel box of the full frame that was rendered, None for the whole frame
+            'roi': list(roi) if roi is not None else None,
+            'roi_cropped': roi is not None and ROI_CROP,
+        },
+    }
+
+def sink_dir(name, worker=None):
+    """Return the folder of a shared sink (annotations, shards) in OUTPUT_DIR, or of one worker's part of it."""
+    if worker is None:
+        return os.path.join(OUTPUT_DIR, name)
+    return os.path.join(OUTPUT_DIR, name, f'worker_{worker}')
+
+def write_view_outputs(captured, store, shard_writer, journal, sink_lock, run_trace=None, catalog=None):
+    """Write the image, annotations and journal record of a captured view.
+
+    Never touches bpy, so it can run on an OutputPipeline writer thread. Shared
+    sinks (store, shards, journal) are only used while holding sink_lock.
+    The view's trace is written to run_trace and its row to the catalog once everything is written.
+    """
+    view = captured['view']
+    trace = captured['trace']
+    annotation = captured['annotation']
+    group_mask = captured['group_mask']
+    image_path = captured['image_path']
+    with trace.span('encode_png'):
+        image_bytes = encode_png(captured['pixels']) if captured['pixels'] is not None else None
+
+    info = {}
+    if shard_writer is not None:
+        with trace.span('write_annotations'):
+            if image_bytes is None:
+                with open(image_path, 'rb') as f:
+                    image_bytes = f.read()
+            if annotation is None:
+                # Stored as an empty sample, like the header-only CSV of the other formats
+                annotation = (np.empty(0, dtype=np.uint32), np.empty((0, 3)), np.empty((0, 2)), np.empty(0, dtype=bool))
+            indices, world_cos, screen_positions, visibility = annotation
+            arrays = {
+                'vertex_index': indices.astype(np.uint32),
+                'world': world_cos.astype(np.float32),
+                'screen': screen_positions.astype(np.float32),
+                'visible': visibility.astype(np.uint8),
+            }
+            if group_mask is not None:
+                arrays['group_mask'] = group_mask
+            with sink_lock:
+                shard_writer.write(view['name'], image_bytes, arrays, captured['metadata'])
+                row = shard_writer.index[-1]
+                outputs = [os.path.relpath(os.path.join(shard_writer.shard_dir, row['shard']), OUTPUT_DIR)]
+                # The shard keeps growing, so only the sample's own bytes can be checked later
+                info = {'shard_offset': row['offset'], 'shard_size': row['size']}
+            # The image now lives in the shard, so don't leave a loose file behind
+            if os.path.exists(image_path):
+                os.remove(image_path)
+    else:
+        with trace.span('write_image'):
+            if image_bytes is not None:
+                with open(image_path, 'wb') as f:
+                    f.write(image_bytes)
+        with trace.span('write_annotations'):
+            if store is not None:
+                if annotation is not None:
+                    with sink_lock:
+                        store.append(view['name'], *annotation, captured['width'], captured['height'], group_mask=group_mask)
+                outputs = [os.path.basename(image_path), os.path.relpath(store.store_dir, OUTPUT_DIR)]
+            else:
+                output_csv = os.path.splitext(image_path)[0] + '.csv'
+                write_annotation_csv(output_csv, annotation, captured['width'], captured['height'], group_mask)
+                outputs = [os.path.basename(image_path), os.path.basename(output_csv)]
+
+    # Only record the view once all of its outputs are written
+    with trace.span('journal'):
+        with sink_lock:
+            roi = captured['metadata']['roi']
+            if roi is not None:
+                info.update(roi=roi, roi_cropped=captured['metadata']['roi_cropped'])
+            journal.record(view, outputs=outputs, **info)
+    if catalog is not None:
+        with trace.span('catalog'):
+            counts = None
+            if annotation is not None:
+                counts = annotation_counts(annotation[2], annotation[3], captured['width'], captured['height'])
+            catalog.add_view(
+                CATALOG_SUBJECT or os.path.basename(os.path.normpath(SUBJECT_DIR)),
+                CATALOG_RUN or os.path.basename(os.path.normpath(OUTPUT_DIR)), OUTPUT_DIR, view, counts,
+                trace.stages.get('render'), captured['width'], captured['height'], outputs[0], outputs[-1],
+                captured['metadata']['vertex_groups'],
+            )
+    if run_trace is not None:
+        run_trace.write(trace)
+
+def choose_camera_locations(rng, cursor_location):
+    """Return NUM_RANDOM_VERTICES camera locations for VIEWPOINT_MODE, drawn from rng."""
+    if VIEWPOINT_MODE == 'hemisphere':
+        hemisphere_mesh = bpy.data.objects.get(HEMISPHERE_MESH_NAME)
+        return rng.sample(get_vertices_from_mesh(hemisphere_mesh), NUM_RANDOM_VERTICES)
+
+    locations, _ = sample_viewpoints(
+        NUM_RANDOM_VERTICES, VIEWPOINT_MODE, tuple(cursor_location), VIEWPOINT_RADIUS_RANGE,
+        VIEWPOINT_THETA_RANGE, VIEWPOINT_PHI_RANGE, np.random.default_rng(rng.randrange(2 ** 32)),
+    )
+    return [Vector(location) for location in locations]
+
+def candidate_locations(rng, cursor_location):
+    """Yield camera locations for VIEWPOINT_MODE without end, in the order they should be tried."""
+    if VIEWPOINT_MODE == 'hemisphere':
+        hemisphere_mesh = bpy.data.objects.get(HEMISPHERE_MESH_NAME)
+        vertices = get_vertices_from_mesh(hemisphere_mesh)
+        while True:
+            yield from rng.sample(vertices, len(vertices))
+
+    # Whole batches keep the spacing of the sampler, later batches only fill in rejected poses
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    while True:
+        locations, _ = sample_viewpoints(
+            NUM_RANDOM_VERTICES, VIEWPOINT_MODE, tuple(cursor_location), VIEWPOINT_RADIUS_RANGE,
+            VIEWPOINT_THETA_RANGE, VIEWPOINT_PHI_RANGE, np_rng,
+        )
+        yield from (Vector(location) for location in locations)
+
+def choose_gated_camera_locations(rng, cursor_location, gate):
+    """Like choose_camera_locations, but replace poses that barely see the vertex groups.
+
+    Each candidate is checked with a vectorized projection of all annotated
+    groups, at the vertex positions annotation uses, which costs milliseconds
+    instead of a full render.
+    """
+    scene = bpy.context.scene
+    camera = bpy.data.objects.get(CAMERA_NAME)
+    target_obj = bpy.data.objects.get(TARGET_OBJECT_NAME)
+    indices, _ = VertexGroupIndex.from_mesh(target_obj).union(group_names_of(VERTEX_GROUP_NAMES or VERTEX_GROUP_NAME))
+    # Only the camera moves between candidates, so the subject is read once
+    world_co = normals = None
+    if SUBJECT_CACHE:
+        world_co, normals = SubjectCache(target_obj).get()
+        world_co, normals = world_co[indices], normals[indices]
+
+    locations = []
+    for location in islice(candidate_locations(rng, cursor_location), VIEW_GATE_MAX_CANDIDATES):
+        camera.location = location
+        camera.rotation_euler = look_at_rotation(location, cursor_location)
         bpy.context.view_layer.update()
-        output_image = os.path.join(OUTPUT_DIR, f'view_{index:03}.png')
-        output_csv = os.path.join(OUTPUT_DIR, f'view_{index:03}.csv')
-        bpy.context.scene.render.filepath = output_image
-        bpy.ops.render.render(write_still=True)
-        write_vertices_to_csv(target_obj, vertex_group_name, camera.name, output_csv)
+        in_frame, visible = estimate_view_quality(scene, camera, target_obj, indices, backface_threshold=BACKFACE_THRESHOLD,
+                                                  world_co=world_co, normals=normals)
+        if gate.check(in_frame, visible):
+            locations.append(location)
+            if len(locations) == NUM_RANDOM_VERTICES:
+                break
+        else:
+            print(f"Rejected viewpoint {tuple(round(c, 3) for c in location)}: {in_frame:.0%} in frame, {visible:.0%} visible")
+
+    stats = gate.stats
+    rejected = stats['rejected_in_frame'] + stats['rejected_visible']
+    print(f"View gate: {stats['accepted']} of {stats['candidates']} candidates accepted, {stats['rejected_in_frame']} "
+          f"rejected for framing and {stats['rejected_visible']} for visibility ({rejected} renders saved)")
+    if len(locations) < NUM_RANDOM_VERTICES:
+        print(f"Only {len(locations)} of {NUM_RANDOM_VERTICES} viewpoints passed the view gate "
+              f"within {VIEW_GATE_MAX_CANDIDATES} candidates, lower the thresholds to get more")
+    return locations
+
+def build_view_plan(cursor_location, hdri_manager, seed):
+    """Draw the camera pose, HDRI and strength of every view from one seeded generator."""
+    rng = random.Random(seed)
+    views = []
+    gate = ViewGate(VIEW_GATE_MIN_IN_FRAME, VIEW_GATE_MIN_VISIBLE) if VIEW_GATE_MIN_IN_FRAME > 0 or VIEW_GATE_MIN_VISIBLE > 0 else None
+    if gate is not None:
+        locations = choose_gated_camera_locations(rng, cursor_location, gate)
+    else:
+        locations = choose_camera_locations(rng, cursor_location)
+    for index, location in enumerate(locations):
+        rotation = look_at_rotation(location, cursor_location)
+        hdri_path, background_strength = hdri_manager.choose(rng, BACKGROUND_STRENGTH_RANGE)
+        views.append(make_view(index, location, rotation, hdri_path, background_strength))
+
+    offsets = np.array([tuple(location - cursor_location) for location in locations]).reshape(-1, 3)
+    coverage = angular_coverage(offsets, VIEWPOINT_THETA_RANGE, VIEWPOINT_PHI_RANGE, VIEWPOINT_COVERAGE_ANGLE)
+    print(f"{len(views)} '{VIEWPOINT_MODE}' viewpoints cover {coverage['coverage']:.1%} of the patch "
+          f"(mean gap {coverage['mean_gap_deg']:.2f} deg, max gap {coverage['max_gap_deg']:.2f} deg)")
+
+    settings = {
+        'hemisphere': HEMISPHERE_MESH_NAME, 'target': TARGET_OBJECT_NAME, 'vertex_group': VERTEX_GROUP_NAME, 'vertex_groups': VERTEX_GROUP_NAMES, 'hdri_dir': HDRI_DIR,
+        'viewpoint_mode': VIEWPOINT_MODE, 'radius_range': list(VIEWPOINT_RADIUS_RANGE),
+        'theta_range': list(VIEWPOINT_THETA_RANGE), 'phi_range': list(VIEWPOINT_PHI_RANGE), 'coverage': coverage,
+        'view_gate': gate.summary() if gate is not None else None,
+        'roi_render': ROI_RENDER, 'roi_crop': ROI_RENDER and ROI_CROP,
+    }
+    return ViewPlan(views, seed, settings)
+
+def make_scene_state(camera, hdri_manager):
+    """Return the SceneState the render loop applies each view's camera, HDRI, strength and render border through."""
+    scene = bpy.context.scene
+    scene_state = SceneState(update=bpy.context.view_layer.update, diff=SCENE_DELTAS)
+    # The annotations read the camera matrix back, so moving it needs a view layer update
+    scene_state.register('camera_location', lambda location: setattr(camera, 'location', location), needs_update=True)
+    scene_state.register('camera_rotation', lambda rotation: setattr(camera, 'rotation_euler', rotation), needs_update=True)
+    scene_state.register('hdri', hdri_manager.set_image)
+    scene_state.register('strength', hdri_manager.set_strength)
+    scene_state.register('render_border', lambda box: set_render_border(scene, box, ROI_CROP))
+    return scene_state
+
+def print_scene_state_summary(scene_state):
+    summary = scene_state.summary()
+    changes = ', '.join(f"{name} {count}" for name, count in summary['changes'].items() if count)
+    print(f"Scene state: {summary['writes']} property writes, {summary['writes_skipped']} skipped as unchanged, "
+          f"{summary['updates']} view layer updates, {summary['updates_skipped']} skipped (changes: {changes or 'none'})")
+
+def apply_view_hdri(view, pending, position, hdri_manager, prefetcher, trace, scene_state):
+    """Read the HDRIs of the next views ahead and apply the HDRI of this one. Returns the changed properties."""
+    # The plan fixes every view's HDRI, so the files of the next views can be read ahead
+    upcoming = pending[position:position + HDRI_PREFETCH_AHEAD + 1]
+    prefetcher.prefetch(v['hdri'] for v in upcoming if v['hdri'] not in hdri_manager.images)
+
+    hdri_path, background_strength = view['hdri'], view['strength']
+    hdri_wait = prefetcher.wait(hdri_path)
+    trace.add('hdri_prefetch_wait', hdri_wait)
+    with trace.span('hdri_apply'):
+        load_start = time.perf_counter()
+        changed = scene_state.apply(hdri=hdri_path, strength=background_strength)
+        hdri_wait += time.perf_counter() - load_start
+    print(f"Applied HDRI: {hdri_path}, strength: {background_strength}, waited {hdri_wait:.3f}s")
+    return changed
+
+def view_region(camera, target_obj, vertex_group_name, group_index, subject_cache=None):
+    """Return the pixel box ROI_RENDER renders for the current camera pose, or None for the whole frame."""
+    scene = bpy.context.scene
+    indices, _ = group_index.union(group_names_of(vertex_group_name))
+    world_co = subject_cache.get()[0][indices] if subject_cache is not None else None
+    _, _, co_ndc = project_vertices(scene, camera, target_obj, indices, world_co)
+    return region_of_interest(scene, camera, co_ndc, ROI_MARGIN, ROI_MIN_SIZE)
+
+def render_stills(camera, pending, vertex_group_name, target_obj, group_index, hdri_manager, prefetcher, run_trace, emit,
+                  subject_cache=None):
+    """Render every pending view with its own still render and emit its captured outputs."""
+    scene = bpy.context.scene
+    frame_width, frame_height = render_size(scene)
+    frame_pixels = frame_width * frame_height
+    rendered_pixels = 0
+    saved_seconds = 0.0
+    scene_state = make_scene_state(camera, hdri_manager)
+    # Restores the border settings of the scene once the loop is done
+    with render_border(scene, None):
+        for position, view in enumerate(pending):
+            trace = run_trace.view(view['name'])
+            changed = apply_view_hdri(view, pending, position, hdri_manager, prefetcher, trace, scene_state)
+
+            with trace.span('scene_update'):
+                changed += scene_state.apply(camera_location=tuple(view['location']), camera_rotation=tuple(view['rotation']))
+            roi = None
+            if ROI_RENDER:
+                with trace.span('roi'):
+                    roi = view_region(camera, target_obj, vertex_group_name, group_index, subject_cache)
+                    changed += scene_state.apply(render_border=roi)
+            trace.count('scene_changes', len(changed))
+            print(f"Changed for {view['name']}: {', '.join(changed) or 'nothing'}")
+
+            output_image = os.path.join(OUTPUT_DIR, f"{view['name']}.png")
+            scene.render.filepath = output_image
+            render_start = time.perf_counter()
+            with trace.span('render'):
+                bpy.ops.render.render(write_still=not PIPELINE_CAPTURE_PIXELS)
+            render_seconds = time.perf_counter() - render_start
+
+            pixels = region_pixels(roi) if roi is not None else frame_pixels
+            rendered_pixels += pixels
+            trace.count('rendered_pixels', pixels)
+            if ROI_RENDER:
+                # Assumes render time scales with the pixel count, so this is an upper bound
+                saved = render_seconds * (frame_pixels / pixels - 1)
+                saved_seconds += saved
+                print(f"Rendered {pixels} of {frame_pixels} pixels ({pixels / frame_pixels:.0%}), about {saved:.1f}s saved")
+
+            # Everything that needs bpy happens here, the writing itself can overlap the next render
+            emit(capture_view(view, camera, target_obj, vertex_group_name, group_index, output_image, trace, subject_cache, roi))
+
+    print_scene_state_summary(scene_state)
+    if ROI_RENDER and pending:
+        print(f"ROI rendering: {rendered_pixels / (frame_pixels * len(pending)):.0%} of the frame pixels rendered, "
+              f"about {saved_seconds:.1f}s saved over {len(pending)} views")
+
+def render_animation(camera, pending, vertex_group_name, target_obj, group_index, hdri_manager, prefetcher, run_trace, emit,
+                     subject_cache=None):
+    """Render every pending view as one frame of a single animation job.
+
+    The views are baked into camera keyframes and rendered with persistent data,
+    so Cycles syncs the scene once instead of once per view. HDRIs can't be
+    keyframed, so frame_change_pre swaps them. Annotations are captured in
+    frame_change_post and emitted once render_write reports the frame's image.
+    """
+    if not pending:
+        return
+    scene = bpy.context.scene
+    frames = dict(enumerate(pending, start=1))
+    traces = {}
+    captured = {}
+    render_starts = {}
+    # The camera follows its keyframes here, only the HDRI and strength go through the scene state
+    scene_state = make_scene_state(camera, hdri_manager)
+
+    def on_frame_change_pre(scene, depsgraph=None):
+        frame = scene.frame_current
+        if frame not in frames or frame in traces:
+            return
+        traces[frame] = run_trace.view(frames[frame]['name'])
+        changed = apply_view_hdri(frames[frame], pending, frame - 1, hdri_manager, prefetcher, traces[frame], scene_state)
+        traces[frame].count('scene_changes', len(changed))
 
-        # Update cache file after each render
-        with open(CACHE_FILE, 'w') as file:
-            file.write(str(index + 1))
+    def on_frame_change_post(scene, depsgraph=None):
+        frame = scene.frame_current
+        if frame not in traces or frame in captured:
+            return
+        view = frames[frame]
+        # The evaluated camera carries the keyed transform of this frame
+        camera_eval = camera.evaluated_get(depsgraph) if depsgraph is not None else camera
+        output_image = os.path.join(OUTPUT_DIR, f"{view['name']}.png")
+        captured[frame] = capture_view(view, camera_eval, target_obj, vertex_group_name, group_index, output_image,
+                                       traces[frame], subject_cache)
+        render_starts[frame] = time.perf_counter()
+
+    def on_render_write(scene, depsgraph=None):
+        frame = scene.frame_current
+        if frame not in captured:
+            return
+        item = captured.pop(frame)
+        item['trace'].add('render', time.perf_counter() - render_starts.pop(frame))
+        # Blender names the file after the frame, the outputs are named after the view
+        os.replace(scene.render.frame_path(frame=frame), item['image_path'])
+        emit(item)
 
-# Main execution flow
-def main():
-    # Ensure output directory exists
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
+    bake_camera_keyframes(camera, pending)
+    try:
+        with animation_render_settings(scene, 1, len(pending), os.path.join(OUTPUT_DIR, 'frame_####')):
+            with frame_handlers(frame_change_pre=on_frame_change_pre, frame_change_post=on_frame_change_post,
+                                render_write=on_render_write):
+                bpy.ops.render.render(animation=True)
+    finally:
+        camera.animation_data_clear()
+    print_scene_state_summary(scene_state)
+    if captured:
+        print(f"Animation render stopped early, {len(captured)} views were not written")
+
+def render_camera_from_vertices(camera, view_plan, journal, vertex_group_name, target_obj, batches=None,
+                                on_batch_error=None, worker=None):
+    """Render the views of the plan that are not in the journal yet and save each with corresponding CSV.
+
+    vertex_group_name can also be a list of groups, which are annotated together in one pass.
+    batches can replace the pending views with an iterable of view lists, e.g. leased from a queue,
+    which are all written to the same sinks. A batch that raises is passed to on_batch_error if given,
+    and an empty batch waits for the output writers to finish every view emitted so far.
+    With worker set, the columnar store and shards go to a worker_<worker> sub folder, so several
+    workers can share OUTPUT_DIR.
+    """
+    run_trace = RunTrace(OUTPUT_DIR)
+    setup_trace = ViewTrace('setup', kind='setup')
+    # Group membership never changes between views, so look it up once for the whole run
+    with setup_trace.span('group_index'):
+        group_index = VertexGroupIndex.from_mesh(target_obj)
+    run_trace.write(setup_trace)
+    subject_cache = SubjectCache(target_obj) if SUBJECT_CACHE else None
+    with_group_mask = len(group_names_of(vertex_group_name)) > 1
+    store = AnnotationStore(sink_dir('annotations', worker), with_group_mask) if ANNOTATION_FORMAT == 'columnar' else None
+    shard_writer = ShardWriter(sink_dir('shards', worker), MAX_SHARD_BYTES) if ANNOTATION_FORMAT == 'shards' else None
+
+    hdri_manager = get_hdri_manager(HDRI_DIR)
+    if batches is None:
+        pending = journal.pending(view_plan)
+        print(f"{len(view_plan) - len(pending)} of {len(view_plan)} views already rendered, {len(pending)} to go")
+        batches = [pending]
+    prefetcher = HDRIPrefetcher()
+
+    def on_write_error(view, e):
+        # Only the view whose write failed, not the batch rendering when the error shows up
+        on_batch_error([view], e)
+
+    pipeline = None
+    if PIPELINE_WRITERS > 0:
+        pipeline = OutputPipeline(PIPELINE_WRITERS, PIPELINE_MAX_PENDING,
+                                  on_write_error if on_batch_error is not None else None)
+    sink_lock = pipeline.sink_lock if pipeline is not None else threading.Lock()
+    catalog = Catalog(CATALOG_DB) if CATALOG_DB else None
+
+    def emit(captured):
+        """Hand a captured view to the output stage, on the writer threads if there are any."""
+        if pipeline is not None:
+            blocked = pipeline.submit(write_view_outputs, captured, store, shard_writer, journal, sink_lock, run_trace,
+                                      catalog, context=captured['view'])
+            if blocked > 0.01:
+                print(f"Waited {blocked:.3f}s for the output writers to catch up")
+        else:
+            write_view_outputs(captured, store, shard_writer, journal, sink_lock, run_trace, catalog)
+
+    render_views = render_animation if RENDER_MODE == 'animation' else render_stills
+    start = time.perf_counter()
+    num_rendered = 0
+    try:
+        for pending in batches:
+            if not pending:
+                if pipeline is not None:
+                    pipeline.flush()
+                continue
+            try:
+                render_views(camera, pending, vertex_group_name, target_obj, group_index, hdri_manager, prefetcher,
+                             run_trace, emit, subject_cache)
+            except Exception as e:
+                if on_batch_error is None:
+                    raise
+                on_batch_error(pending, e)
+                continue
+            num_rendered += len(pending)
+        if num_rendered:
+            elapsed = time.perf_counter() - start
+            print(f"Rendered {num_rendered} views in {elapsed:.1f}s ({elapsed / num_rendered:.2f}s per view, {RENDER_MODE} mode)")
+    finally:
+        prefetcher.close()
+        if subject_cache is not None:
+            print(f"Subject cache: {subject_cache.hits} hits, {subject_cache.misses} misses")
+        # Flush pending writes before the sinks they write to are closed
+        if pipeline is not None:
+            pipeline.close()
+            print(f"Render loop waited {pipeline.blocked_seconds:.1f}s in total for the output writers")
+        if store is not None:
+            store.close()
+        if shard_writer is not None:
+            shard_writer.close()
+        if catalog is not None:
+            catalog.close()
+
+def reannotate_views(camera, views, journal, vertex_group_name, target_obj, output_dir):
+    """Recompute the annotations of already rendered views from their recorded camera poses, without rendering.
+
+    Writes one CSV per view into output_dir, or a columnar store with
+    ANNOTATION_FORMAT = 'columnar', and records each view in the journal.
+    Views rendered with ROI_CROP carry their roi and roi_cropped (see
+    reannotate.recorded_views), and are annotated in the cropped image's pixels.
+    """
+    if VISIBILITY_MODE == 'depth':
+        raise ValueError("Re-annotation doesn't render, so it can't use VISIBILITY_MODE 'depth'")
+    group_index = VertexGroupIndex.from_mesh(target_obj)
+    subject_cache = SubjectCache(target_obj) if SUBJECT_CACHE else None
+    group_names = group_names_of(vertex_group_name)
+    with_group_mask = len(group_names) > 1
+    store = AnnotationStore(os.path.join(output_dir, 'annotations'), with_group_mask) if ANNOTATION_FORMAT == 'columnar' else None
+    scene = bpy.context.scene
+    width, height = scene.render.resolution_x, scene.render.resolution_y
 
+    start = time.perf_counter()
+    try:
+        for view in views:
+            camera.location = view['location']
+            camera.rotation_euler = view['rotation']
+            bpy.context.view_layer.update()
+            result = annotate_vertex_groups(target_obj, group_names, camera, group_index, None, view['name'],
+                                            subject_cache=subject_cache)
+            annotation, group_mask = result if result is not None else (None, None)
+            group_mask = group_mask if with_group_mask else None
+            view_width, view_height = width, height
+            info = {}
+            if view.get('roi_cropped'):
+                annotation, view_width, view_height = crop_annotation(annotation, view['roi'])
+                info = {'roi': view['roi'], 'roi_cropped': True}
+            if store is not None:
+                if annotation is not None:
+                    store.append(view['name'], *annotation, view_width, view_height, group_mask=group_mask)
+                outputs = ['annotations']
+            else:
+                output_csv = os.path.join(output_dir, f"{view['name']}.csv")
+                write_annotation_csv(output_csv, annotation, view_width, view_height, group_mask)
+                outputs = [os.path.basename(output_csv)]
+            journal.record(view, outputs=outputs, **info)
+    finally:
+        if store is not None:
+            store.close()
+
+    elapsed = time.perf_counter() - start
+    if subject_cache is not None:
+        print(f"Subject cache: {subject_cache.hits} hits, {subject_cache.misses} misses")
+    if views:
+        print(f"Re-annotated {len(views)} views in {elapsed:.1f}s ({len(views) / elapsed:.2f} views/s)")
+
+def consume_queue(camera, view_plan, vertex_group_name, target_obj):
+    """Render views leased from the shared job queue until every view is done or failed.
+
+    The worker keeps its sinks open across batches, and writes the columnar
+    store or shards into its own worker_<name> folder, since several nodes share OUTPUT_DIR.
+    """
+    queue = JobQueue(QUEUE_DB, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS)
+    queue.add_plan(view_plan)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    journal = QueueJournal(queue, worker, OUTPUT_DIR)
+    views = {view['index']: view for view in view_plan}
+
+    def leased_batches():
+        while True:
+            indices = queue.lease(worker, QUEUE_BATCH_SIZE)
+            if indices:
+                yield [views[index] for index in indices]
+                continue
+            # An empty batch has the writers finish every view emitted so far
+            yield []
+            # Our heartbeat keeps leases alive that no write will ever record, hand them back
+            leftover = queue.leased_indices(worker)
+            for index in leftover:
+                queue.fail(worker, index, 'leased but never recorded')
+            if leftover:
+                # Views with attempts left are pending again
+                continue
+            if queue.leased_by_others(worker) == 0:
+                return
+            # Other workers still hold leases, which come back to the queue if they expire
+            time.sleep(QUEUE_POLL_SECONDS)
+
+    def fail_batch(batch, e):
+        print(f"Failed to render views {[view['index'] for view in batch]}: {e}")
+        for view in batch:
+            queue.fail(worker, view['index'], e)
+
+    try:
+        with LeaseHeartbeat(QUEUE_DB, worker, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS):
+            render_camera_from_vertices(camera, view_plan, journal, vertex_group_name, target_obj,
+                                        leased_batches(), fail_batch, worker)
+    finally:
+        queue.release(worker)
+        print(f"Queue status: {queue.counts()}")
+        queue.close()
+
+def setup_scene():
+    """Create the render camera and configure Cycles. Returns (camera, target object)."""
     # Initialize camera
     bpy.ops.object.select_all(action='DESELECT')
     bpy.ops.object.select_by_type(type='CAMERA')
@@ -188,11 +883,7 @@ def main():
     camera.name = CAMERA_NAME
     bpy.context.scene.camera = camera
 
-    hemisphere_mesh = bpy.data.objects.get(HEMISPHERE_MESH_NAME)
-    vertices = get_vertices_from_mesh(hemisphere_mesh)
-
     target_obj = bpy.data.objects.get(TARGET_OBJECT_NAME)
-    cursor_location = bpy.context.scene.cursor.location
 
     bpy.context.scene.render.engine = 'CYCLES'
     bpy.context.scene.cycles.device = 'GPU'
@@ -206,17 +897,61 @@ def main():
     bpy.context.scene.render.image_settings.file_format = 'PNG'
     bpy.context.scene.cycles.samples = 128
 
-    # Resume rendering from cache
-    start_index = 0
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as file:
-            try:
-                start_index = int(file.read())
-            except ValueError:
-                start_index = 0
+    if VISIBILITY_MODE == 'depth':
+        enable_depth_pass(bpy.context.scene)
+
+    if ROI_RENDER and RENDER_MODE == 'animation':
+        raise ValueError("ROI_RENDER changes the render border per view, which RENDER_MODE 'animation' can't do")
+    if ROI_RENDER and ROI_CROP and VISIBILITY_MODE == 'depth':
+        raise ValueError("ROI_CROP crops the depth pass, which VISIBILITY_MODE 'depth' reads as the full frame")
+
+    if RENDER_MODE == 'animation' and (VISIBILITY_MODE == 'depth' or PIPELINE_CAPTURE_PIXELS):
+        raise ValueError("RENDER_MODE 'animation' captures annotations before each frame renders, "
+                         "so it can't read the depth pass or pixels back")
+
+    if PIPELINE_CAPTURE_PIXELS:
+        if VISIBILITY_MODE == 'depth':
+            raise ValueError("PIPELINE_CAPTURE_PIXELS needs the Viewer node, which VISIBILITY_MODE 'depth' already uses")
+        # encode_png applies the plain sRGB curve, so render with the matching view transform
+        bpy.context.scene.view_settings.view_transform = 'Standard'
+        connect_viewer(bpy.context.scene, 'Image', use_alpha=True)
+
+    return camera, target_obj
+
+def load_or_build_plan(output_dir):
+    """Load the view plan of a run, or draw a new one and save it before anything is rendered."""
+    # Reuse the plan of a resumed run so exactly the same views are rendered
+    if ViewPlan.exists(output_dir):
+        view_plan = ViewPlan.load(output_dir)
+        print(f"Resuming run {output_dir} (seed {view_plan.seed})")
+        return view_plan
+
+    cursor_location = bpy.context.scene.cursor.location.copy()
+    seed = PLAN_SEED if PLAN_SEED is not None else random.randrange(2 ** 32)
+    view_plan = build_view_plan(cursor_location, get_hdri_manager(HDRI_DIR), seed)
+    view_plan.save(output_dir)
+    return view_plan
+
+# Main execution flow
+def main():
+    if QUEUE_DB and RUN_NAME is None:
+        raise ValueError("Set RUN_NAME when rendering from a queue, a timestamped run folder differs on every node")
+    if QUEUE_DB and PLAN_SEED is None and not ViewPlan.exists(OUTPUT_DIR):
+        raise ValueError("Set PLAN_SEED when rendering from a queue, so every node draws the same view plan")
+
+    # Ensure output directory exists
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    camera, target_obj = setup_scene()
+    view_plan = load_or_build_plan(OUTPUT_DIR)
+    if QUEUE_DB:
+        consume_queue(camera, view_plan, VERTEX_GROUP_NAMES or VERTEX_GROUP_NAME, target_obj)
+        return
 
-    random_vertices = random.sample(vertices, NUM_RANDOM_VERTICES)
-    render_camera_from_vertices(camera, random_vertices, cursor_location, hemisphere_mesh, VERTEX_GROUP_NAME, target_obj, start_index)
+    journal = CompletionJournal(OUTPUT_DIR)
+    render_camera_from_vertices(camera, view_plan, journal, VERTEX_GROUP_NAMES or VERTEX_GROUP_NAME, target_obj)
 
-# Run the main function
-main()
+# Run the main function (not when imported by render_worker.py)
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,14 @@ from math import radians
 from mathutils import Vector
 from bpy_extras.object_utils import world_to_camera_view
 import datetime
+import sys
+
+# Make the helper modules next to this script importable from Blender
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+
+from projection import project_vertices
 
 # Constants
 HEMISPHERE_MESH_NAME = "Hemisphere"
@@ -146,18 +154,19 @@ def write_vertices_to_csv(mesh_obj, vertex_group_name, camera_name, file_path):
 
         vertex_group = mesh_obj.vertex_groups[vertex_group_name]
 
-        for i, vert in enumerate(mesh_data.vertices):
-            for group in vert.groups:
-                if group.group == vertex_group.index:
-                    world_co = mesh_obj.matrix_world @ vert.co
-                    screen_pos = world_space_to_screen_space(camera_name, world_co)
-                    visible = vertex_visibility(scene, camera_obj, mesh_obj, vert)
-                    visibility_text = 'Yes' if visible else 'No'
+        indices = [i for i, vert in enumerate(mesh_data.vertices) if any(group.group == vertex_group.index for group in vert.groups)]
+
+        # Project every group vertex in one call instead of once per vertex
+        world_cos, screen_positions, _ = project_vertices(scene, camera_obj, mesh_obj, indices)
+
+        for i, world_co, screen_pos in zip(indices, world_cos.tolist(), screen_positions.tolist()):
+            visible = vertex_visibility(scene, camera_obj, mesh_obj, mesh_data.vertices[i])
+            visibility_text = 'Yes' if visible else 'No'
 
-                    csvwriter.writerow([i, world_co.x, world_co.y, world_co.z, screen_pos[0], screen_pos[1], visibility_text, scene.render.resolution_x, scene.render.resolution_y, 1.0, 1.0])
+            csvwriter.writerow([i, world_co[0], world_co[1], world_co[2], screen_pos[0], screen_pos[1], visibility_text, scene.render.resolution_x, scene.render.resolution_y, 1.0, 1.0])
 
-                    if i % 1000 == 0:
-                        print(f"Vertex {i}: ({world_co.x}, {world_co.y}, {world_co.z})")
+            if i % 1000 == 0:
+                print(f"Vertex {i}: ({world_co[0]}, {world_co[1]}, {world_co[2]})")
 
 def render_camera_from_vertices(camera, vertices, cursor_location, mesh_obj, vertex_group_name, target_obj, start_index=0):
     """Render views from the vertices on the mesh and save each with corresponding CSV."""
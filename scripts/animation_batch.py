@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+
+import bpy
+
+
+def bake_camera_keyframes(camera, views, frame_start=1):
+    """Key the camera location and rotation of each view on consecutive frames. Returns the last frame."""
+    camera.animation_data_clear()
+    for frame, view in enumerate(views, start=frame_start):
+        camera.location = view['location']
+        camera.rotation_euler = view['rotation']
+        camera.keyframe_insert('location', frame=frame)
+        camera.keyframe_insert('rotation_euler', frame=frame)
+    return frame_start + len(views) - 1
+
+
+@contextmanager
+def frame_handlers(**handlers):
+    """Register bpy.app.handlers callbacks (e.g. frame_change_pre=fn) for the duration of the block."""
+    registered = []
+    try:
+        for name, fn in handlers.items():
+            getattr(bpy.app.handlers, name).append(fn)
+            registered.append((name, fn))
+        yield
+    finally:
+        for name, fn in registered:
+            handler_list = getattr(bpy.app.handlers, name)
+            if fn in handler_list:
+                handler_list.remove(fn)
+
+
+@contextmanager
+def animation_render_settings(scene, frame_start, frame_end, filepath):
+    """Set the scene up for one animation job with persistent data, restoring the old settings afterwards.
+
+    Persistent data keeps the synced scene, BVH and textures between frames.
+    Motion blur is turned off, it would blend neighbouring views. The interface
+    is locked so handlers can change the scene safely while rendering.
+    """
+    render = scene.render
+    saved = (scene.frame_start, scene.frame_end, scene.frame_current, render.filepath,
+             render.use_persistent_data, render.use_lock_interface, render.use_motion_blur)
+    scene.frame_start, scene.frame_end = frame_start, frame_end
+    render.filepath = filepath
+    render.use_persistent_data = True
+    render.use_lock_interface = True
+    render.use_motion_blur = False
+    try:
+        yield
+    finally:
+        (scene.frame_start, scene.frame_end, frame_current, render.filepath,
+         render.use_persistent_data, render.use_lock_interface, render.use_motion_blur) = saved
+        scene.frame_set(frame_current)
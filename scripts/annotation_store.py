@@ -0,0 +1,168 @@
+import csv
+import os
+
+import numpy as np
+
+# Column name -> (dtype, values per vertex). Each column is one flat binary file.
+COLUMNS = {
+    'vertex_index': (np.uint32, 1),
+    'world': (np.float32, 3),
+    'screen': (np.float32, 2),
+    'visible': (np.uint8, 1),
+}
+# Written only by stores opened with with_group_mask, for multi-group annotations
+GROUP_MASK_COLUMNS = {'group_mask': (np.uint64, 1)}
+VIEW_FIELDS = ['view', 'offset', 'count', 'width', 'height', 'scale_x', 'scale_y']
+VIEWS_FILE = 'views.csv'
+
+
+def _column_path(store_dir, name):
+    return os.path.join(store_dir, f'{name}.bin')
+
+
+def _read_views(store_dir):
+    """Read the per-view metadata table."""
+    views_path = os.path.join(store_dir, VIEWS_FILE)
+    if not os.path.exists(views_path):
+        return []
+    with open(views_path, 'r', newline='') as f:
+        views = []
+        for row in csv.DictReader(f):
+            views.append({
+                'view': row['view'],
+                'offset': int(row['offset']),
+                'count': int(row['count']),
+                'width': int(row['width']),
+                'height': int(row['height']),
+                'scale_x': float(row['scale_x']),
+                'scale_y': float(row['scale_y']),
+            })
+        return views
+
+
+class AnnotationStore:
+    """Appendable columnar store for the per-view vertex annotations of a run.
+
+    Vertex rows of every view are appended to one binary file per column, and
+    a small views.csv table records where each view starts together with its
+    intrinsics. The views table is written last, so a crash mid view leaves the
+    previous views intact and the partial rows are dropped on the next open.
+    With with_group_mask, a group_mask column holds the group bitmask of every row.
+    """
+
+    def __init__(self, store_dir, with_group_mask=False):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        views = _read_views(store_dir)
+        self.num_rows = views[-1]['offset'] + views[-1]['count'] if views else 0
+        has_group_mask = os.path.exists(_column_path(store_dir, 'group_mask'))
+        if self.num_rows and has_group_mask != with_group_mask:
+            raise ValueError(f"{store_dir} already has views {'with' if has_group_mask else 'without'} a group mask")
+
+        self.columns = dict(COLUMNS, **GROUP_MASK_COLUMNS) if with_group_mask else COLUMNS
+        self.files = {}
+        for name, (dtype, size) in self.columns.items():
+            path = _column_path(store_dir, name)
+            f = open(path, 'ab')
+            # Drop rows of a view that was not recorded in the views table
+            f.truncate(self.num_rows * size * np.dtype(dtype).itemsize)
+            self.files[name] = f
+
+        views_path = os.path.join(store_dir, VIEWS_FILE)
+        write_header = not os.path.exists(views_path)
+        self.views_file = open(views_path, 'a', newline='')
+        self.views_writer = csv.writer(self.views_file)
+        if write_header:
+            self.views_writer.writerow(VIEW_FIELDS)
+            self.views_file.flush()
+
+    def append(self, view, indices, world_co, screen_co, visible, width, height, scale_x=1.0, scale_y=1.0, group_mask=None):
+        """Append the annotations of one view. group_mask is required if the store has that column."""
+        count = len(indices)
+        arrays = {
+            'vertex_index': indices,
+            'world': world_co,
+            'screen': screen_co,
+            'visible': visible,
+            'group_mask': group_mask,
+        }
+        for name, (dtype, size) in self.columns.items():
+            data = np.ascontiguousarray(arrays[name], dtype=dtype).reshape(count, size)
+            self.files[name].write(data.tobytes())
+            self.files[name].flush()
+
+        self.views_writer.writerow([view, self.num_rows, count, width, height, scale_x, scale_y])
+        self.views_file.flush()
+        self.num_rows += count
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.views_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AnnotationReader:
+    """Read a store written by AnnotationStore as NumPy views over memory-mapped columns."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.views = _read_views(store_dir)
+        num_rows = self.views[-1]['offset'] + self.views[-1]['count'] if self.views else 0
+
+        # Later records win, so a view rendered again after a resume replaces the old one
+        self.view_lookup = {meta['view']: meta for meta in self.views}
+
+        columns = dict(COLUMNS)
+        if os.path.exists(_column_path(store_dir, 'group_mask')):
+            columns.update(GROUP_MASK_COLUMNS)
+
+        self.columns = {}
+        for name, (dtype, size) in columns.items():
+            if num_rows == 0:
+                self.columns[name] = np.empty((0, size), dtype=dtype)
+                continue
+            column = np.memmap(_column_path(store_dir, name), dtype=dtype, mode='r', shape=(num_rows * size,))
+            self.columns[name] = column.reshape(num_rows, size)
+
+    def __len__(self):
+        return len(self.view_lookup)
+
+    def view_names(self):
+        """Return the recorded view names in the order they were written."""
+        return list(self.view_lookup)
+
+    def get(self, view):
+        """Return the metadata and column arrays of one view. The arrays are views, not copies."""
+        meta = self.view_lookup[view]
+        rows = slice(meta['offset'], meta['offset'] + meta['count'])
+        annotation = {
+            'vertex_index': self.columns['vertex_index'][rows, 0],
+            'world': self.columns['world'][rows],
+            'screen': self.columns['screen'][rows],
+            'visible': self.columns['visible'][rows, 0],
+        }
+        if 'group_mask' in self.columns:
+            annotation['group_mask'] = self.columns['group_mask'][rows, 0]
+        return meta, annotation
+
+
+def merge_store(source_dir, store_dir):
+    """Append every view of the store in source_dir to the store in store_dir, after its existing rows.
+
+    Returns the number of views appended.
+    """
+    reader = AnnotationReader(source_dir)
+    with_group_mask = 'group_mask' in reader.columns
+    with AnnotationStore(store_dir, with_group_mask) as store:
+        for meta in reader.views:
+            _, annotation = reader.get(meta['view'])
+            store.append(meta['view'], annotation['vertex_index'], annotation['world'], annotation['screen'],
+                         annotation['visible'], meta['width'], meta['height'], meta['scale_x'], meta['scale_y'],
+                         group_mask=annotation.get('group_mask'))
+    return len(reader.views)
@@ -0,0 +1,188 @@
+"""Benchmark the vertex annotation engines outside of Blender, using bpy_stub.
+
+Example:
+    python benchmark_annotation.py --save benchmark_baseline.json
+    python benchmark_annotation.py --compare benchmark_baseline.json
+
+Engines:
+    legacy   the original per-vertex loop (world_to_camera_view + scene.ray_cast per vertex)
+    raycast  vectorized projection, one scene ray cast per vertex (VISIBILITY_MODE 'raycast')
+    tiered   frustum and backface culling before BVH ray casts (VISIBILITY_MODE 'tiered')
+    cached   tiered, with world space vertices and normals from a warm SubjectCache
+    depth    lookup in the rendered Z pass (VISIBILITY_MODE 'depth')
+Each is timed together with writing the view's CSV. --compare exits with 1
+if any engine got slower than the saved results by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Make the helper modules next to this script importable
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+
+import bpy_stub
+
+bpy_stub.install()
+
+import Render_Cached
+from subject_cache import SubjectCache
+from vertex_groups import VertexGroupIndex
+
+ENGINES = ['legacy', 'raycast', 'tiered', 'cached', 'depth']
+SIZES = [10_000, 100_000, 1_000_000]
+# The per-vertex engines take minutes at 1M vertices in pure Python
+DEFAULT_MAX_VERTICES = {'legacy': 100_000, 'raycast': 100_000}
+
+
+def annotate_legacy(scene, camera, mesh_obj, group_index):
+    """The per-vertex loop write_vertices_to_csv used before annotate_vertices."""
+    mesh_data = mesh_obj.data
+    indices = group_index.indices(Render_Cached.VERTEX_GROUP_NAME)
+    world_cos, screen_positions, visibility = [], [], []
+    for i in indices.tolist():
+        vertex = mesh_data.vertices[i]
+        world_co = mesh_obj.matrix_world @ vertex.co
+        world_cos.append(tuple(world_co))
+        screen_positions.append(Render_Cached.world_space_to_screen_space(camera.name, world_co))
+        visibility.append(Render_Cached.vertex_visibility(scene, camera, mesh_obj, vertex))
+    return indices, np.array(world_cos), np.array(screen_positions), np.array(visibility, dtype=bool)
+
+
+def run_engine(engine, scene, camera, mesh_obj, group_index, depth, subject_cache=None):
+    if engine == 'legacy':
+        return annotate_legacy(scene, camera, mesh_obj, group_index)
+    if engine == 'cached':
+        Render_Cached.VISIBILITY_MODE = 'tiered'
+        result = Render_Cached.annotate_vertex_groups(
+            mesh_obj, [Render_Cached.VERTEX_GROUP_NAME], camera, group_index, None, 'benchmark', subject_cache=subject_cache,
+        )
+        return result[0] if result is not None else None
+    Render_Cached.VISIBILITY_MODE = engine
+    return Render_Cached.annotate_vertices(
+        mesh_obj, Render_Cached.VERTEX_GROUP_NAME, camera, group_index, depth if engine == 'depth' else None, 'benchmark',
+    )
+
+
+def benchmark(sizes, engines, repeat, max_vertices):
+    """Time every engine at every size. Returns a list of result dicts."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='annotation_benchmark_') as tmp_dir:
+        for size in sizes:
+            results.extend(benchmark_size(size, engines, repeat, max_vertices, tmp_dir))
+    return results
+
+
+def benchmark_size(size, engines, repeat, max_vertices, tmp_dir):
+    """Time every engine on a mesh with size vertices."""
+    results = []
+    scene, camera, mesh_obj = bpy_stub.make_scene(size, group_name=Render_Cached.VERTEX_GROUP_NAME,
+                                                  mesh_name=Render_Cached.TARGET_OBJECT_NAME,
+                                                  camera_name=Render_Cached.CAMERA_NAME)
+    # Group membership and the depth pass come from setup and the renderer, not the annotation step
+    group_index = VertexGroupIndex.from_mesh(mesh_obj)
+    depth = bpy_stub.render_depth(scene, camera, mesh_obj)
+    num_vertices = len(group_index.indices(Render_Cached.VERTEX_GROUP_NAME))
+    # Warmed up once, like after the first view of a run
+    subject_cache = SubjectCache(mesh_obj)
+    subject_cache.get()
+    reference = None
+
+    for engine in engines:
+        if size > max_vertices.get(engine, size):
+            print(f"{engine:>8} {size:>9}: skipped (above --max-vertices)")
+            continue
+        csv_path = os.path.join(tmp_dir, f'{engine}_{size}.csv')
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            annotation = run_engine(engine, scene, camera, mesh_obj, group_index, depth, subject_cache)
+            Render_Cached.write_annotation_csv(csv_path, annotation, scene.render.resolution_x, scene.render.resolution_y)
+            timings.append(time.perf_counter() - start)
+
+        # Engines should agree on visibility, apart from vertices right at the silhouette
+        visibility = annotation[3]
+        if reference is None:
+            reference, reference_engine = visibility, engine
+        mismatches = int((visibility != reference).sum())
+
+        best = min(timings)
+        result = {
+            'engine': engine,
+            'vertices': size,
+            'group_vertices': num_vertices,
+            'seconds': best,
+            'vertices_per_second': num_vertices / best,
+            'visible': int(visibility.sum()),
+            'mismatches': mismatches,
+        }
+        results.append(result)
+        print(f"{engine:>8} {size:>9}: {best:8.3f}s {result['vertices_per_second']:>12,.0f} vertices/s, "
+              f"{result['visible']} visible, {mismatches} differ from {reference_engine}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the results that are slower than the baseline by more than tolerance."""
+    previous = {(r['engine'], r['vertices']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['engine'], result['vertices']))
+        if before is None:
+            continue
+        ratio = result['vertices_per_second'] / before['vertices_per_second']
+        status = 'SLOWER' if ratio < 1 - tolerance else 'ok'
+        print(f"{result['engine']:>8} {result['vertices']:>9}: {ratio:6.2f}x of baseline {status}")
+        if status != 'ok':
+            regressions.append(result)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark vertex annotation outside of Blender")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per engine and size, the fastest counts")
+    parser.add_argument('--max-vertices', type=int, help="skip any engine above this mesh size "
+                        f"(default: {DEFAULT_MAX_VERTICES} for the per-vertex engines)")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON file saved earlier with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against --compare")
+    args = parser.parse_args(argv)
+
+    if args.max_vertices is not None:
+        max_vertices = {engine: args.max_vertices for engine in args.engines}
+    else:
+        max_vertices = DEFAULT_MAX_VERTICES
+    results = benchmark(args.sizes, args.engines, args.repeat, max_vertices)
+
+    if args.save:
+        report = {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results,
+        }
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            print("Annotation got slower than the baseline")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""Small stand-in for the parts of bpy, mathutils and bpy_extras the annotation code uses.
+
+It lets the projection, visibility and annotation functions run outside of
+Blender, e.g. for benchmark_annotation.py. Only a synthetic scene is
+supported: a UV-less sphere mesh with one vertex group, a perspective camera
+looking at it, and ray casts that hit the sphere analytically.
+
+    import bpy_stub
+    bpy_stub.install()
+    scene, camera, mesh_obj = bpy_stub.make_scene(100000)
+    import Render_Cached
+"""
+import math
+import sys
+import types
+
+import numpy as np
+
+
+class Vector:
+    """3D (or 4D) vector with the mathutils operations used by the scripts."""
+
+    __slots__ = ('_v',)
+
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self._v = tuple(float(value) for value in values)
+
+    x = property(lambda self: self._v[0])
+    y = property(lambda self: self._v[1])
+    z = property(lambda self: self._v[2])
+
+    def __len__(self):
+        return len(self._v)
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def __getitem__(self, index):
+        return self._v[index]
+
+    def __add__(self, other):
+        return Vector([a + b for a, b in zip(self._v, other)])
+
+    def __sub__(self, other):
+        return Vector([a - b for a, b in zip(self._v, other)])
+
+    def __neg__(self):
+        return Vector([-a for a in self._v])
+
+    def __mul__(self, scalar):
+        return Vector([a * scalar for a in self._v])
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, scalar):
+        return Vector([a / scalar for a in self._v])
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self._v, other))
+
+    @property
+    def length(self):
+        return math.sqrt(self.dot(self._v))
+
+    def normalized(self):
+        length = self.length
+        return Vector(self._v) if length == 0.0 else self / length
+
+    def copy(self):
+        return Vector(self._v)
+
+    def __repr__(self):
+        return f"Vector({self._v})"
+
+
+class Matrix:
+    """4x4 matrix backed by a NumPy array."""
+
+    def __init__(self, rows=None):
+        self._m = np.identity(4) if rows is None else np.array(rows, dtype=np.float64).reshape(4, 4)
+
+    def __iter__(self):
+        return (tuple(row) for row in self._m)
+
+    def __matmul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix(self._m @ other._m)
+        # A 3D vector is treated as a point, like mathutils does for 4x4 matrices
+        x, y, z = other[0], other[1], other[2]
+        m = self._m
+        return Vector((
+            m[0, 0] * x + m[0, 1] * y + m[0, 2] * z + m[0, 3],
+            m[1, 0] * x + m[1, 1] * y + m[1, 2] * z + m[1, 3],
+            m[2, 0] * x + m[2, 1] * y + m[2, 2] * z + m[2, 3],
+        ))
+
+    @property
+    def translation(self):
+        return Vector(self._m[:3, 3])
+
+    def inverted(self):
+        return Matrix(np.linalg.inv(self._m))
+
+    def normalized(self):
+        """Return a copy with unit length axes (the 3x3 columns), like Matrix.normalized()."""
+        m = self._m.copy()
+        m[:3, :3] /= np.linalg.norm(m[:3, :3], axis=0)
+        return Matrix(m)
+
+    def copy(self):
+        return Matrix(self._m)
+
+
+def look_at_matrix(location, target):
+    """Return the world matrix of a camera at location looking at target, with +Z up."""
+    location = np.asarray(location, dtype=np.float64)
+    forward = np.asarray(target, dtype=np.float64) - location
+    forward /= np.linalg.norm(forward)
+    # Cameras look down their local -Z axis with local +Y up
+    z_axis = -forward
+    x_axis = np.cross((0.0, 0.0, 1.0), z_axis)
+    if np.linalg.norm(x_axis) < 1e-9:
+        x_axis = np.array((1.0, 0.0, 0.0))
+    x_axis /= np.linalg.norm(x_axis)
+    y_axis = np.cross(z_axis, x_axis)
+    m = np.identity(4)
+    m[:3, 0], m[:3, 1], m[:3, 2], m[:3, 3] = x_axis, y_axis, z_axis, location
+    return Matrix(m)
+
+
+def ray_sphere(origin, direction, center, radius):
+    """Return the nearest hit distance of a ray with a sphere, or None."""
+    oc = [o - c for o, c in zip(origin, center)]
+    b = sum(d * o for d, o in zip(direction, oc))
+    c = sum(o * o for o in oc) - radius * radius
+    disc = b * b - c
+    if disc < 0.0:
+        return None
+    root = math.sqrt(disc)
+    for distance in (-b - root, -b + root):
+        if distance > 1e-9:
+            return distance
+    return None
+
+
+class Object:
+    """Stand-in for bpy.types.Object."""
+
+    def __init__(self, name, obj_type, data, matrix_world=None):
+        self.name = name
+        self.type = obj_type
+        self.data = data
+        self.matrix_world = matrix_world or Matrix()
+        self.vertex_groups = []
+        self.modifiers = []
+
+    @property
+    def location(self):
+        return self.matrix_world.translation
+
+    def evaluated_get(self, depsgraph):
+        return self
+
+    def to_mesh(self):
+        # Without modifiers the evaluated mesh is the mesh itself
+        return self.data
+
+    def to_mesh_clear(self):
+        pass
+
+
+class VertexGroup:
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class VertexGroups(list):
+    """List of VertexGroup that also supports `name in groups`, like bpy collections."""
+
+    def __contains__(self, name):
+        return any(group.name == name for group in self)
+
+
+class VertexGroupElement:
+    def __init__(self, group, weight):
+        self.group = group
+        self.weight = weight
+
+
+class MeshVertex:
+    def __init__(self, vertices, index):
+        self.index = index
+        self.co = Vector(vertices.co[index])
+        self.normal = Vector(vertices.normal[index])
+        self.groups = [VertexGroupElement(group, weight) for group, weight in vertices.groups.get(index, ())]
+
+
+class MeshVertices:
+    """Vertex collection with foreach_get, creating MeshVertex objects on access."""
+
+    def __init__(self, co, normal, groups):
+        self.co = co
+        self.normal = normal
+        # Maps vertex index -> [(group index, weight)]
+        self.groups = groups
+
+    def __len__(self):
+        return len(self.co)
+
+    def __getitem__(self, index):
+        return MeshVertex(self, index)
+
+    def __iter__(self):
+        return (MeshVertex(self, index) for index in range(len(self.co)))
+
+    def foreach_get(self, attr, out):
+        out[:] = getattr(self, attr).ravel()
+
+
+class Mesh:
+    def __init__(self, name, co, normal, groups):
+        self.name = name
+        self.vertices = MeshVertices(co, normal, groups)
+        self.shape_keys = None
+
+
+class SphereMesh(Mesh):
+    """Mesh whose vertices lie on a sphere around the object origin, ray cast analytically."""
+
+    def __init__(self, name, co, groups, radius):
+        normal = co / np.linalg.norm(co, axis=1, keepdims=True)
+        super().__init__(name, co, normal, groups)
+        self.radius = radius
+
+
+class CameraData:
+    def __init__(self, lens=50.0, sensor_width=36.0, clip_start=0.1, clip_end=100.0):
+        self.type = 'PERSP'
+        self.lens = lens
+        self.sensor_width = sensor_width
+        self.clip_start = clip_start
+        self.clip_end = clip_end
+
+    def view_frame(self, scene=None):
+        """Return the frame corners at unit depth: top right, bottom right, bottom left, top left."""
+        width, height = scene.render.resolution_x, scene.render.resolution_y
+        half = self.sensor_width / 2 / self.lens
+        half_x, half_y = (half, half * height / width) if width >= height else (half * width / height, half)
+        return [
+            Vector((half_x, half_y, -1.0)),
+            Vector((half_x, -half_y, -1.0)),
+            Vector((-half_x, -half_y, -1.0)),
+            Vector((-half_x, half_y, -1.0)),
+        ]
+
+
+class BVHTree:
+    """Stand-in for mathutils.bvhtree.BVHTree that only knows sphere meshes."""
+
+    def __init__(self, radius):
+        self.radius = radius
+
+    @classmethod
+    def FromObject(cls, obj, depsgraph):
+        return cls(obj.data.radius)
+
+    def ray_cast(self, origin, direction):
+        distance = ray_sphere(origin, direction, (0.0, 0.0, 0.0), self.radius)
+        if distance is None:
+            return None, None, None, None
+        location = Vector(origin) + Vector(direction) * distance
+        return location, location.normalized(), 0, distance
+
+
+class Scene:
+    def __init__(self, resolution=(512, 512)):
+        self.render = types.SimpleNamespace(
+            resolution_x=resolution[0], resolution_y=resolution[1], resolution_percentage=100,
+        )
+        self.objects = []
+
+    def ray_cast(self, depsgraph, origin, direction):
+        """Ray cast against the sphere meshes of the scene, with the bpy return layout."""
+        nearest = (False, Vector(), Vector(), -1, None, None)
+        nearest_distance = float('inf')
+        for obj in self.objects:
+            if not isinstance(obj.data, SphereMesh):
+                continue
+            center = obj.matrix_world.translation
+            distance = ray_sphere(origin, direction, center, obj.data.radius)
+            if distance is not None and distance < nearest_distance:
+                location = Vector(origin) + Vector(direction) * distance
+                nearest = (True, location, (location - center).normalized(), 0, obj, obj.matrix_world)
+                nearest_distance = distance
+        return nearest
+
+
+def world_to_camera_view(scene, obj, coord):
+    """Port of bpy_extras.object_utils.world_to_camera_view."""
+    co_local = obj.matrix_world.normalized().inverted() @ coord
+    z = -co_local.z
+
+    camera = obj.data
+    frame = [v for v in camera.view_frame(scene=scene)[:3]]
+    if camera.type != 'ORTHO':
+        if z == 0.0:
+            return Vector((0.5, 0.5, 0.0))
+        frame = [-(v / (v.z / z)) for v in frame]
+
+    min_x, max_x = frame[2].x, frame[1].x
+    min_y, max_y = frame[1].y, frame[0].y
+    x = (co_local.x - min_x) / (max_x - min_x)
+    y = (co_local.y - min_y) / (max_y - min_y)
+    return Vector((x, y, z))
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+bpy = _module('bpy')
+
+
+def install():
+    """Register the stand-in modules in sys.modules, so `import bpy` etc. pick them up."""
+    bpy.types = _module('bpy.types', Object=Object)
+    bpy.data = types.SimpleNamespace(objects={}, images={})
+    bpy.context = types.SimpleNamespace(
+        scene=Scene(),
+        view_layer=types.SimpleNamespace(update=lambda: None, use_pass_z=False),
+        evaluated_depsgraph_get=lambda: None,
+    )
+    object_utils = _module('bpy_extras.object_utils', world_to_camera_view=world_to_camera_view)
+    bvhtree = _module('mathutils.bvhtree', BVHTree=BVHTree)
+    mathutils = _module('mathutils', Vector=Vector, Matrix=Matrix, bvhtree=bvhtree)
+    sys.modules.update({
+        'bpy': bpy,
+        'bpy.types': bpy.types,
+        'bpy_extras': _module('bpy_extras', object_utils=object_utils),
+        'bpy_extras.object_utils': object_utils,
+        'mathutils': mathutils,
+        'mathutils.bvhtree': bvhtree,
+    })
+
+
+def fibonacci_sphere(count, radius=1.0):
+    """Return count roughly evenly spaced points on a sphere."""
+    i = np.arange(count, dtype=np.float64) + 0.5
+    z = 1 - 2 * i / count
+    r = np.sqrt(1 - z * z)
+    phi = i * math.pi * (3 - math.sqrt(5))
+    return (np.column_stack((r * np.cos(phi), r * np.sin(phi), z)) * radius).astype(np.float32)
+
+
+def make_scene(num_vertices, group_name='Head', group_min_z=-0.2, resolution=(512, 512),
+               camera_location=(0.0, -4.0, 0.5), mesh_name='HG_Body', camera_name='Render_Camera'):
+    """Build a sphere mesh with a vertex group and a camera looking at it in the stand-in bpy.
+
+    Vertices above group_min_z belong to the group. Returns (scene, camera, mesh_obj).
+    """
+    scene = Scene(resolution)
+    bpy.context.scene = scene
+
+    co = fibonacci_sphere(num_vertices)
+    members = np.flatnonzero(co[:, 2] > group_min_z)
+    groups = {int(index): [(0, 1.0)] for index in members}
+    mesh_obj = Object(mesh_name, 'MESH', SphereMesh(mesh_name, co, groups, radius=1.0))
+    mesh_obj.vertex_groups = VertexGroups([VertexGroup(group_name, 0)])
+
+    camera = Object(camera_name, 'CAMERA', CameraData(), look_at_matrix(camera_location, (0.0, 0.0, 0.0)))
+    scene.objects = [mesh_obj, camera]
+    bpy.data.objects = {mesh_obj.name: mesh_obj, camera.name: camera}
+    return scene, camera, mesh_obj
+
+
+def render_depth(scene, camera, mesh_obj):
+    """Return the (height, width) Z pass a render of the sphere would produce, rows bottom-up."""
+    width, height = scene.render.resolution_x, scene.render.resolution_y
+    frame = camera.data.view_frame(scene=scene)
+    max_x, max_y = frame[0].x, frame[0].y
+    u = ((np.arange(width) + 0.5) / width * 2 - 1) * max_x
+    v = ((np.arange(height) + 0.5) / height * 2 - 1) * max_y
+    uu, vv = np.meshgrid(u, v)
+
+    # Rays in camera space through each pixel centre, at unit depth along -Z
+    rays = np.stack((uu, vv, -np.ones_like(uu)), axis=-1)
+    cam_matrix = np.array(list(camera.matrix_world))
+    directions = rays @ cam_matrix[:3, :3].T
+    origin = cam_matrix[:3, 3]
+    center = np.array(list(mesh_obj.matrix_world.translation))
+
+    # Solve |origin + t * d - center| = r for t, with t measured in units of view depth
+    oc = origin - center
+    a = np.einsum('ijk,ijk->ij', directions, directions)
+    b = 2 * directions @ oc
+    c = oc @ oc - mesh_obj.data.radius ** 2
+    disc = b * b - 4 * a * c
+    depth = np.full((height, width), camera.data.clip_end * 10, dtype=np.float32)
+    hit = disc >= 0
+    depth[hit] = (-b[hit] - np.sqrt(disc[hit])) / (2 * a[hit])
+    return depth
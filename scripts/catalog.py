@@ -0,0 +1,309 @@
+"""SQLite catalog of rendered views, one row per view across subjects and runs.
+
+Example:
+    python catalog.py index --db generated_data/catalog.sqlite generated_data/Abby/202405070214
+    python catalog.py query --db generated_data/catalog.sqlite --min-visible 500 --max-strength 0.3
+
+Render_Cached.py adds a row for every view it writes (CATALOG_DB). index adds
+the views of runs rendered before the catalog existed, and refreshes the paths
+of farm runs after render_farm.py collected the worker outputs.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from annotation_store import AnnotationReader
+from render_trace import read_trace
+from shards import iter_shard
+from view_plan import ViewPlan
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS views (
+    subject TEXT NOT NULL,
+    run TEXT NOT NULL,
+    view TEXT NOT NULL,
+    view_index INTEGER,
+    camera_x REAL, camera_y REAL, camera_z REAL,
+    rotation_x REAL, rotation_y REAL, rotation_z REAL,
+    hdri TEXT,
+    background_strength REAL,
+    vertex_groups TEXT,
+    group_vertices INTEGER,
+    in_frame INTEGER,
+    visible INTEGER,
+    render_seconds REAL,
+    width INTEGER,
+    height INTEGER,
+    output_dir TEXT NOT NULL,
+    image TEXT,
+    annotation TEXT,
+    added REAL,
+    PRIMARY KEY (subject, run, view)
+);
+CREATE INDEX IF NOT EXISTS views_visible ON views (visible);
+CREATE INDEX IF NOT EXISTS views_in_frame ON views (in_frame);
+CREATE INDEX IF NOT EXISTS views_strength ON views (background_strength);
+CREATE INDEX IF NOT EXISTS views_hdri ON views (hdri);
+'''
+COLUMNS = [
+    'subject', 'run', 'view', 'view_index', 'camera_x', 'camera_y', 'camera_z', 'rotation_x', 'rotation_y', 'rotation_z',
+    'hdri', 'background_strength', 'vertex_groups', 'group_vertices', 'in_frame', 'visible', 'render_seconds',
+    'width', 'height', 'output_dir', 'image', 'annotation', 'added',
+]
+# Query filter -> SQL condition on its value
+FILTERS = {
+    'subject': 'subject = ?',
+    'run': 'run = ?',
+    'hdri': 'hdri LIKE ?',
+    'min_visible': 'visible >= ?',
+    'max_visible': 'visible <= ?',
+    'min_in_frame': 'in_frame >= ?',
+    'max_in_frame': 'in_frame <= ?',
+    'min_strength': 'background_strength >= ?',
+    'max_strength': 'background_strength <= ?',
+}
+
+
+def annotation_counts(screen, visible, width, height):
+    """Return (group_vertices, in_frame, visible) counts of one view's annotation arrays."""
+    screen = np.asarray(screen).reshape(-1, 2)
+    framed = (screen[:, 0] >= 0) & (screen[:, 0] <= width) & (screen[:, 1] >= 0) & (screen[:, 1] <= height)
+    return len(screen), int(framed.sum()), int(np.count_nonzero(visible))
+
+
+class Catalog:
+    """One row per rendered view, keyed by (subject, run, view).
+
+    Adding a view again replaces its row, so resumed runs and re-indexing
+    never duplicate views. Rows may be added from output writer threads, the
+    connection is shared behind a lock. Like the job queue, the database uses
+    the rollback journal, so it can live on a shared drive.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=DELETE')
+        self.connection.executescript(SCHEMA)
+
+    def add_rows(self, rows):
+        """Insert or replace rows given as dicts with the keys of COLUMNS."""
+        placeholders = ', '.join('?' * len(COLUMNS))
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO views ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                [tuple(row.get(column) for column in COLUMNS) for row in rows],
+            )
+
+    def add_view(self, subject, run, output_dir, view, counts=None, render_seconds=None, width=None, height=None,
+                 image=None, annotation=None, vertex_groups=None):
+        """Record one view of a plan (a make_view dict). image and annotation are relative to output_dir."""
+        self.add_rows([view_row(subject, run, output_dir, view, counts, render_seconds, width, height,
+                                image, annotation, vertex_groups)])
+
+    def query(self, limit=None, order_by='subject, run, view_index', **filters):
+        """Return the rows matching every filter of FILTERS as dicts, e.g. query(min_visible=500, max_strength=0.3).
+
+        hdri matches a substring of the HDRI path.
+        """
+        conditions, values = [], []
+        for name, value in filters.items():
+            if name not in FILTERS:
+                raise ValueError(f"Unknown catalog filter '{name}', use one of {', '.join(FILTERS)}")
+            if value is None:
+                continue
+            conditions.append(FILTERS[name])
+            values.append(f'%{value}%' if name == 'hdri' else value)
+        sql = 'SELECT * FROM views'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f' ORDER BY {order_by}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            values.append(int(limit))
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, values)]
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM views').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def view_row(subject, run, output_dir, view, counts=None, render_seconds=None, width=None, height=None,
+             image=None, annotation=None, vertex_groups=None):
+    """Build a catalog row. Views without a recorded camera pose get empty pose columns."""
+    location = view.get('location') or [None] * 3
+    rotation = view.get('rotation') or [None] * 3
+    group_vertices, in_frame, visible = counts or (None, None, None)
+    if isinstance(vertex_groups, (list, tuple)):
+        vertex_groups = ','.join(vertex_groups)
+    return {
+        'subject': subject,
+        'run': run,
+        'view': view['name'],
+        'view_index': view.get('index'),
+        'camera_x': location[0], 'camera_y': location[1], 'camera_z': location[2],
+        'rotation_x': rotation[0], 'rotation_y': rotation[1], 'rotation_z': rotation[2],
+        'hdri': view.get('hdri'),
+        'background_strength': view.get('strength'),
+        'vertex_groups': vertex_groups,
+        'group_vertices': group_vertices,
+        'in_frame': in_frame,
+        'visible': visible,
+        'render_seconds': render_seconds,
+        'width': width,
+        'height': height,
+        'output_dir': os.path.abspath(output_dir),
+        'image': image,
+        'annotation': annotation,
+        'added': time.time(),
+    }
+
+
+def output_path(row, name='image'):
+    """Return the absolute path of a row's image or annotation output."""
+    return os.path.join(row['output_dir'], row[name]) if row[name] else None
+
+
+def _read_csv_annotation(csv_path):
+    """Return (screen, visible, width, height) of a view_###.csv."""
+    with open(csv_path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    screen = np.array([(float(row['Screen X']), float(row['Screen Y'])) for row in rows], dtype=np.float64).reshape(-1, 2)
+    visible = np.array([row['Visible'] == 'Yes' for row in rows], dtype=bool)
+    width, height = (int(rows[0]['Width']), int(rows[0]['Height'])) if rows else (None, None)
+    return screen, visible, width, height
+
+
+def _annotated_views(output_dir):
+    """Yield (view name, counts, width, height, image, annotation, metadata) for every annotated view of a folder."""
+    shard_dir = os.path.join(output_dir, 'shards')
+    for shard_dir in [shard_dir] + sorted(glob.glob(os.path.join(shard_dir, 'worker_*'))):
+        for shard_path in sorted(glob.glob(os.path.join(shard_dir, 'shard-*.tar'))):
+            shard = os.path.relpath(shard_path, output_dir)
+            for sample in iter_shard(shard_path):
+                metadata = sample['metadata']
+                arrays = sample['annotation']
+                counts = annotation_counts(arrays['screen'], arrays['visible'], metadata['width'], metadata['height'])
+                yield metadata['view'], counts, metadata['width'], metadata['height'], shard, shard, metadata
+
+    store_dir = os.path.join(output_dir, 'annotations')
+    for store_dir in [store_dir] + sorted(glob.glob(os.path.join(store_dir, 'worker_*'))):
+        if not os.path.isdir(store_dir):
+            continue
+        reader = AnnotationReader(store_dir)
+        for name in reader.view_names():
+            meta, arrays = reader.get(name)
+            counts = annotation_counts(arrays['screen'], arrays['visible'], meta['width'], meta['height'])
+            image = f'{name}.png' if os.path.exists(os.path.join(output_dir, f'{name}.png')) else None
+            yield name, counts, meta['width'], meta['height'], image, os.path.relpath(store_dir, output_dir), None
+
+    for csv_path in sorted(glob.glob(os.path.join(output_dir, 'view_*.csv'))):
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        screen, visible, width, height = _read_csv_annotation(csv_path)
+        image = f'{name}.png' if os.path.exists(os.path.join(output_dir, f'{name}.png')) else None
+        yield name, annotation_counts(screen, visible, width, height), width, height, image, os.path.basename(csv_path), None
+
+
+def index_run(catalog, run_dir, subject=None, run=None):
+    """Add every annotated view of a run folder to the catalog. Returns the number of views added.
+
+    Camera poses, HDRIs and strengths come from the view plan or the shard
+    metadata, render times from trace.jsonl. subject and run default to the
+    names of the subject and run folders.
+    """
+    run_dir = os.path.normpath(run_dir)
+    subject = subject or os.path.basename(os.path.dirname(run_dir))
+    run = run or os.path.basename(run_dir)
+    plan = ViewPlan.load(run_dir) if ViewPlan.exists(run_dir) else None
+    planned = {view['name']: view for view in plan} if plan is not None else {}
+    vertex_groups = (plan.settings.get('vertex_groups') or plan.settings.get('vertex_group')) if plan is not None else None
+
+    render_seconds = {}
+    for trace_path in [os.path.join(run_dir, 'trace.jsonl')] + glob.glob(os.path.join(run_dir, '*', '*', 'trace.jsonl')):
+        if os.path.exists(trace_path):
+            for record in read_trace(trace_path):
+                if record.get('kind', 'view') == 'view' and 'render' in record['stages']:
+                    render_seconds[record['view']] = record['stages']['render']
+
+    rows = []
+    for name, counts, width, height, image, annotation, metadata in _annotated_views(run_dir):
+        view = planned.get(name)
+        if view is None and metadata is not None:
+            view = {'name': name, 'location': metadata['camera_location'], 'rotation': metadata['camera_rotation'],
+                    'hdri': metadata['hdri'], 'strength': metadata['background_strength']}
+            vertex_groups = metadata.get('vertex_groups') or metadata.get('vertex_group')
+        view = view or {'name': name}
+        if 'index' not in view:
+            suffix = name.rsplit('_', 1)[-1]
+            view = dict(view, index=int(suffix) if suffix.isdigit() else None)
+        rows.append(view_row(subject, run, run_dir, view, counts, render_seconds.get(name), width, height,
+                             image, annotation, vertex_groups))
+    catalog.add_rows(rows)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index and query the catalog of rendered views")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subparsers.add_parser('index', help="add the views of run folders to the catalog")
+    index_parser.add_argument('--db', required=True)
+    index_parser.add_argument('run_dirs', nargs='+')
+
+    query_parser = subparsers.add_parser('query', help="print the views matching every filter")
+    query_parser.add_argument('--db', required=True)
+    for name in FILTERS:
+        value_type = str if name in ('subject', 'run', 'hdri') else float
+        query_parser.add_argument('--' + name.replace('_', '-'), type=value_type)
+    query_parser.add_argument('--limit', type=int)
+    query_parser.add_argument('--format', choices=['table', 'paths', 'json'], default='table',
+                              help="paths prints one image path per line, json one row per line")
+    args = parser.parse_args(argv)
+
+    with Catalog(args.db) as catalog:
+        if args.command == 'index':
+            for run_dir in args.run_dirs:
+                start = time.perf_counter()
+                count = index_run(catalog, run_dir)
+                print(f"Indexed {count} views of {run_dir} in {time.perf_counter() - start:.2f}s")
+            return 0
+
+        start = time.perf_counter()
+        rows = catalog.query(limit=args.limit, **{name: getattr(args, name) for name in FILTERS})
+        elapsed = time.perf_counter() - start
+        if args.format == 'paths':
+            for row in rows:
+                print(output_path(row))
+        elif args.format == 'json':
+            for row in rows:
+                print(json.dumps(row))
+        else:
+            for row in rows:
+                print(f"{row['subject']}/{row['run']}/{row['view']}: {row['visible']} visible, {row['in_frame']} in frame, "
+                      f"strength {row['background_strength']}, {os.path.basename(row['hdri'] or '-')}")
+        print(f"{len(rows)} of {len(catalog)} views match ({elapsed * 1000:.1f}ms)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""Streaming loader for rendered runs, for training code outside of Blender.
+
+Example:
+    loader = DatasetLoader(['generated_data/Abby/run1', 'generated_data/Abby/run2'], shuffle=True, num_workers=4)
+    for sample in loader:
+        image, screen, visible = sample['image'], sample['screen'], sample['visible']
+    print(loader.stats())
+
+    python dataset_loader.py generated_data/Abby/run1 --shuffle --workers 4 --pool process
+
+Images are decoded and annotations read on a thread or process pool, at most
+prefetch samples ahead of the consumer. Columnar stores and tar shards give
+annotation arrays without parsing any text. CSV runs are parsed on the pool,
+off the training thread. Needs NumPy and Pillow (pip install numpy pillow),
+which decodes the PNGs.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import sys
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from annotation_store import AnnotationReader
+from shards import read_index, decode_arrays
+
+# Columnar stores opened by this process, keyed by directory
+_READERS = {}
+_READERS_LOCK = threading.Lock()
+
+
+def decode_png(data):
+    """Decode PNG bytes into a (height, width, channels) array with top-down rows."""
+    with Image.open(io.BytesIO(data)) as image:
+        array = np.asarray(image)
+    return array[:, :, None] if array.ndim == 2 else array
+
+
+def list_samples(run_dirs):
+    """Return references to every annotated view of the run folders, in write order.
+
+    Shards, columnar stores (including the worker_XX folders collected by
+    render_farm.py) and CSV files are all found. A view written more than once
+    is listed once, with its latest output.
+    """
+    if isinstance(run_dirs, str):
+        run_dirs = [run_dirs]
+    samples = []
+    for run_dir in run_dirs:
+        views = {}
+        shard_root = os.path.join(run_dir, 'shards')
+        for shard_dir in [shard_root] + sorted(glob.glob(os.path.join(shard_root, 'worker_*'))):
+            for row in read_index(shard_dir):
+                views[row['key']] = {'kind': 'shard', 'run_dir': run_dir, 'view': row['key'],
+                                     'path': os.path.join(shard_dir, row['shard']), 'offset': row['offset'], 'size': row['size']}
+
+        store_root = os.path.join(run_dir, 'annotations')
+        for store_dir in [store_root] + sorted(glob.glob(os.path.join(store_root, 'worker_*'))):
+            if os.path.isdir(store_dir):
+                for view in AnnotationReader(store_dir).view_names():
+                    views[view] = {'kind': 'columnar', 'run_dir': run_dir, 'view': view, 'path': store_dir,
+                                   'image': os.path.join(run_dir, f'{view}.png')}
+
+        for csv_path in sorted(glob.glob(os.path.join(run_dir, 'view_*.csv'))):
+            view = os.path.splitext(os.path.basename(csv_path))[0]
+            views[view] = {'kind': 'csv', 'run_dir': run_dir, 'view': view, 'path': csv_path,
+                           'image': os.path.join(run_dir, f'{view}.png')}
+        samples.extend(views.values())
+    return samples
+
+
+def _reader(store_dir):
+    with _READERS_LOCK:
+        reader = _READERS.get(store_dir)
+        if reader is None:
+            reader = _READERS[store_dir] = AnnotationReader(store_dir)
+        return reader
+
+
+def _read_file(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def _read_shard_sample(sample):
+    """Return (image bytes, annotation arrays, metadata) of a sample, reading the shard from its offset on."""
+    members = {}
+    with open(sample['path'], 'rb') as f:
+        f.seek(sample['offset'])
+        with tarfile.open(fileobj=f, mode='r|') as tar:
+            for member in tar:
+                key, ext = os.path.splitext(member.name)
+                if key != sample['view']:
+                    break
+                members[ext] = tar.extractfile(member).read()
+    return members.get('.png'), decode_arrays(members['.npz']), json.loads(members['.json'])
+
+
+def _read_csv_sample(csv_path):
+    """Parse a view_###.csv into annotation arrays and the image size."""
+    with open(csv_path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    columns = list(zip(*rows)) if rows else [()] * len(header)
+    column = dict(zip(header, columns))
+    arrays = {
+        'vertex_index': np.array(column['Vertex Index'], dtype=np.uint32),
+        'world': np.array([column['World X'], column['World Y'], column['World Z']], dtype=np.float32).T.reshape(-1, 3),
+        'screen': np.array([column['Screen X'], column['Screen Y']], dtype=np.float32).T.reshape(-1, 2),
+        'visible': np.array(column['Visible']) == 'Yes',
+    }
+    if 'Group Mask' in column:
+        arrays['group_mask'] = np.array(column['Group Mask'], dtype=np.uint64)
+    width, height = (int(rows[0][header.index('Width')]), int(rows[0][header.index('Height')])) if rows else (None, None)
+    return arrays, width, height
+
+
+def load_sample(sample, decode_images=True):
+    """Load one sample listed by list_samples into a dict of arrays.
+
+    Keys: view, run_dir, image ((height, width, channels) array, the PNG bytes
+    with decode_images=False, None without an image), vertex_index, world,
+    screen, visible (bool) and group_mask for multi-group runs, width, height
+    and metadata (shards only).
+    """
+    metadata = None
+    if sample['kind'] == 'shard':
+        image_bytes, arrays, metadata = _read_shard_sample(sample)
+        width, height = metadata['width'], metadata['height']
+        arrays['visible'] = arrays['visible'].astype(bool)
+    elif sample['kind'] == 'columnar':
+        meta, columns = _reader(sample['path']).get(sample['view'])
+        # Copies, so the sample doesn't keep the memory maps alive
+        arrays = {name: np.array(values) for name, values in columns.items()}
+        arrays['visible'] = arrays['visible'].astype(bool)
+        width, height = meta['width'], meta['height']
+        image_bytes = _read_file(sample['image'])
+    else:
+        arrays, width, height = _read_csv_sample(sample['path'])
+        image_bytes = _read_file(sample['image'])
+
+    image = image_bytes
+    if decode_images and image_bytes is not None:
+        image = decode_png(image_bytes)
+    return dict(arrays, view=sample['view'], run_dir=sample['run_dir'], image=image,
+                width=width, height=height, metadata=metadata)
+
+
+class DatasetLoader:
+    """Iterate over the samples of one or more runs, loading them on a worker pool ahead of the consumer.
+
+    At most prefetch samples are being loaded or waiting to be consumed, so
+    memory stays bounded however slow the consumer is. Samples come out in
+    order, shuffled anew every epoch with shuffle=True. pool is 'thread' or
+    'process'; processes sidestep the GIL when parsing CSV runs.
+    stats() tells whether the loader keeps up: if waiting_seconds is close to
+    elapsed_seconds, the consumer spends its time waiting for samples.
+    """
+
+    def __init__(self, run_dirs, shuffle=False, seed=None, num_workers=4, prefetch=16, pool='thread', decode_images=True):
+        if pool not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool '{pool}', use 'thread' or 'process'")
+        self.samples = list_samples(run_dirs)
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.num_workers = num_workers
+        self.prefetch = max(1, prefetch)
+        self.pool = pool
+        self.decode_images = decode_images
+        self.samples_loaded = 0
+        self.elapsed_seconds = 0.0
+        self.waiting_seconds = 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _order(self):
+        return self.rng.permutation(len(self.samples)) if self.shuffle else range(len(self.samples))
+
+    def __iter__(self):
+        executor_class = ProcessPoolExecutor if self.pool == 'process' else ThreadPoolExecutor
+        order = iter(self._order())
+        pending = deque()
+        with executor_class(max_workers=self.num_workers) as executor:
+            def fill():
+                while len(pending) < self.prefetch:
+                    index = next(order, None)
+                    if index is None:
+                        return
+                    pending.append(executor.submit(load_sample, self.samples[index], self.decode_images))
+
+            # Elapsed time includes the consumer's own work between samples, waiting only the time blocked on the pool
+            start = time.perf_counter()
+            elapsed_before = self.elapsed_seconds
+            try:
+                fill()
+                while pending:
+                    wait_start = time.perf_counter()
+                    sample = pending.popleft().result()
+                    self.waiting_seconds += time.perf_counter() - wait_start
+                    self.samples_loaded += 1
+                    fill()
+                    self.elapsed_seconds = elapsed_before + time.perf_counter() - start
+                    yield sample
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def stats(self):
+        """Return the samples loaded so far, samples per second and the time the consumer waited for them."""
+        return {
+            'samples': self.samples_loaded,
+            'elapsed_seconds': self.elapsed_seconds,
+            'waiting_seconds': self.waiting_seconds,
+            'samples_per_second': self.samples_loaded / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how fast rendered runs can be loaded")
+    parser.add_argument('run_dirs', nargs='+')
+    parser.add_argument('--shuffle', action='store_true')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--prefetch', type=int, default=16)
+    parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--no-decode', action='store_true', help="read the image bytes without decoding them")
+    parser.add_argument('--limit', type=int, help="stop after this many samples")
+    args = parser.parse_args(argv)
+
+    loader = DatasetLoader(args.run_dirs, args.shuffle, args.seed, args.workers, args.prefetch, args.pool, not args.no_decode)
+    print(f"{len(loader)} samples in {len(args.run_dirs)} runs")
+    for count, _ in enumerate(loader, start=1):
+        if args.limit and count >= args.limit:
+            break
+    stats = loader.stats()
+    print(f"Loaded {stats['samples']} samples in {stats['elapsed_seconds']:.2f}s ({stats['samples_per_second']:.1f} samples/s), "
+          f"waited {stats['waiting_seconds']:.2f}s for the workers")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
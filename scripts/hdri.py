@@ -0,0 +1,190 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import bpy
+
+HDRI_EXTENSIONS = {'.hdr', '.exr', '.png'}
+ENVIRONMENT_NODE_NAME = 'HDRI Environment'
+BACKGROUND_NODE_NAME = 'HDRI Background'
+
+
+def list_hdri_files(hdri_directory):
+    """Return the sorted HDRI file paths in a directory."""
+    if not os.path.exists(hdri_directory) or not os.path.isdir(hdri_directory):
+        raise ValueError(f"Invalid directory: {hdri_directory}")
+
+    hdri_files = sorted(f for f in os.listdir(hdri_directory) if os.path.splitext(f)[1].lower() in HDRI_EXTENSIONS)
+    if not hdri_files:
+        raise ValueError(f"No valid HDRI files found in directory: {hdri_directory}")
+    return [os.path.join(hdri_directory, f) for f in hdri_files]
+
+
+def image_memory_size(image):
+    """Estimate the memory used by a loaded image, assuming float RGBA pixels."""
+    width, height = image.size
+    return width * height * 4 * 4
+
+
+class HDRIManager:
+    """Swap world HDRIs without rebuilding the world node tree or reloading images.
+
+    The directory is scanned once and the Environment -> Background -> Output
+    graph is built once. Loaded images are kept in an LRU cache bounded by
+    memory_budget bytes, and evicted images are removed from bpy.data.
+    """
+
+    def __init__(self, hdri_directory, memory_budget=2 * 1024 ** 3):
+        self.hdri_directory = hdri_directory
+        self.hdri_files = list_hdri_files(hdri_directory)
+        self.memory_budget = memory_budget
+        self.images = OrderedDict()
+        self.image_sizes = {}
+        self.env_node = None
+        self.background_node = None
+
+    def setup_world(self, world=None):
+        """Build (or find) the HDRI node graph of the world."""
+        world = world or bpy.context.scene.world
+        if not world.use_nodes:
+            world.use_nodes = True
+        nodes = world.node_tree.nodes
+        links = world.node_tree.links
+
+        env_node = nodes.get(ENVIRONMENT_NODE_NAME)
+        background_node = nodes.get(BACKGROUND_NODE_NAME)
+        if env_node is None or background_node is None:
+            # Clear existing nodes except the output node
+            for node in list(nodes):
+                if node.type != 'OUTPUT_WORLD':
+                    nodes.remove(node)
+
+            env_node = nodes.new(type='ShaderNodeTexEnvironment')
+            env_node.name = ENVIRONMENT_NODE_NAME
+            env_node.location = (-300, 0)
+
+            output_node = next(node for node in nodes if node.type == 'OUTPUT_WORLD')
+            background_node = nodes.new(type='ShaderNodeBackground')
+            background_node.name = BACKGROUND_NODE_NAME
+            background_node.location = (-150, 0)
+
+            links.new(env_node.outputs['Color'], background_node.inputs['Color'])
+            links.new(background_node.outputs['Background'], output_node.inputs['Surface'])
+
+        self.env_node = env_node
+        self.background_node = background_node
+
+    def get_image(self, hdri_path):
+        """Return the image datablock of an HDRI, loading it on a cache miss."""
+        image = self.images.get(hdri_path)
+        if image is not None:
+            self.images.move_to_end(hdri_path)
+            return image
+
+        image = bpy.data.images.load(hdri_path, check_existing=True)
+        self.images[hdri_path] = image
+        self.image_sizes[hdri_path] = image_memory_size(image)
+        self.evict(keep=hdri_path)
+        return image
+
+    def evict(self, keep=None):
+        """Free least recently used images until the cache fits the memory budget."""
+        while sum(self.image_sizes.values()) > self.memory_budget and len(self.images) > 1:
+            hdri_path = next(iter(self.images))
+            if hdri_path == keep:
+                self.images.move_to_end(hdri_path)
+                continue
+            image = self.images.pop(hdri_path)
+            del self.image_sizes[hdri_path]
+            if self.env_node is not None and self.env_node.image == image:
+                self.env_node.image = None
+            bpy.data.images.remove(image)
+            print(f"Evicted HDRI from cache: {hdri_path}")
+
+    def apply(self, hdri_path, strength):
+        """Show an HDRI at the given strength, only swapping the image and strength values."""
+        self.set_image(hdri_path)
+        self.set_strength(strength)
+
+    def set_image(self, hdri_path):
+        """Show an HDRI, keeping the current strength."""
+        if self.env_node is None:
+            self.setup_world()
+        image = self.get_image(hdri_path)
+        if self.env_node.image != image:
+            self.env_node.image = image
+
+    def set_strength(self, strength):
+        """Set the background strength, keeping the current HDRI."""
+        if self.background_node is None:
+            self.setup_world()
+        self.background_node.inputs['Strength'].default_value = strength
+
+    def choose(self, rng=random, strength_range=(0, 1)):
+        """Pick a random HDRI path and background strength."""
+        return rng.choice(self.hdri_files), rng.uniform(*strength_range)
+
+    def set_random(self, rng=random, strength_range=(0, 1)):
+        """Apply a random HDRI and strength and return them."""
+        hdri_path, strength = self.choose(rng, strength_range)
+        self.apply(hdri_path, strength)
+        return hdri_path, strength
+
+
+class HDRIPrefetcher:
+    """Read upcoming HDRI files on a background thread so they are in the OS page cache.
+
+    Only plain file reads happen off the main thread. bpy is never touched
+    here, since calling into Blender from another thread breaks depsgraph
+    evaluation. The main thread still does bpy.data.images.load, which is
+    then served from memory instead of disk.
+    """
+
+    def __init__(self, chunk_size=8 * 1024 * 1024):
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='HDRIPrefetcher', daemon=True)
+        self.thread.start()
+
+    def prefetch(self, hdri_paths):
+        """Queue files to be read ahead, skipping ones already queued."""
+        for hdri_path in hdri_paths:
+            with self.lock:
+                if hdri_path in self.pending:
+                    continue
+                event = self.pending[hdri_path] = threading.Event()
+            self.queue.put((hdri_path, event))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            hdri_path, event = item
+            try:
+                with open(hdri_path, 'rb') as f:
+                    while f.read(self.chunk_size):
+                        pass
+            except OSError as e:
+                print(f"Failed to prefetch HDRI {hdri_path}: {e}")
+            finally:
+                event.set()
+
+    def wait(self, hdri_path):
+        """Block until a queued file has been read and return the seconds spent waiting."""
+        with self.lock:
+            event = self.pending.pop(hdri_path, None)
+        if event is None:
+            return 0.0
+        start = time.perf_counter()
+        event.wait()
+        return time.perf_counter() - start
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
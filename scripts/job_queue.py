@@ -0,0 +1,274 @@
+"""SQLite backed queue of planned views, shared by render workers on several nodes.
+
+Example:
+    python job_queue.py init --db queue.sqlite --run-dir generated_data/Abby/run1
+    python job_queue.py status --db queue.sqlite
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from view_plan import ViewPlan
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    view_index INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    checksums TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, view_index);
+'''
+
+
+def file_checksum(file_path, offset=0, size=None):
+    """Return the SHA-256 of a file, or of size bytes of it from offset on."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        remaining = size
+        while remaining is None or remaining > 0:
+            chunk = f.read(1024 * 1024 if remaining is None else min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+class JobQueue:
+    """One row per planned view, leased to workers in batches.
+
+    Leases expire unless the worker sends heartbeats. Expired leases go back
+    to pending until a view has been tried max_attempts times, after which it
+    is marked failed. Every state change runs in an IMMEDIATE transaction, so
+    two workers can never lease the same view. The database uses the rollback
+    journal rather than WAL, because WAL does not work over network file systems.
+    """
+
+    def __init__(self, db_path, lease_seconds=900, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=DELETE')
+        self.connection.executescript(SCHEMA)
+
+    def _transaction(self):
+        return _ImmediateTransaction(self.connection)
+
+    def add_plan(self, view_plan):
+        """Insert a row for each view of the plan. Views already in the queue are left alone."""
+        with self._transaction():
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO jobs (view_index, name, updated) VALUES (?, ?, ?)',
+                [(view['index'], view['name'], time.time()) for view in view_plan],
+            )
+
+    def _expire_leases(self, now):
+        self.connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, error = 'lease expired', updated = ? WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+
+    def lease(self, worker, batch_size=1):
+        """Lease up to batch_size pending views to a worker and return their indices."""
+        now = time.time()
+        with self._transaction():
+            self._expire_leases(now)
+            rows = self.connection.execute(
+                "SELECT view_index FROM jobs WHERE status = 'pending' ORDER BY view_index LIMIT ?", (batch_size,)
+            ).fetchall()
+            indices = [row[0] for row in rows]
+            self.connection.executemany(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated = ? "
+                "WHERE view_index = ?",
+                [(worker, now + self.lease_seconds, now, index) for index in indices],
+            )
+        return indices
+
+    def heartbeat(self, worker):
+        """Extend every lease held by a worker. Returns the number of leases extended."""
+        now = time.time()
+        with self._transaction():
+            cursor = self.connection.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE status = 'leased' AND worker = ?",
+                (now + self.lease_seconds, now, worker),
+            )
+        return cursor.rowcount
+
+    def complete(self, worker, view_index, checksums):
+        """Mark a leased view as done with the checksums of its outputs.
+
+        Returns False if the worker no longer holds the lease, e.g. because it
+        expired and the view was handed to another worker.
+        """
+        with self._transaction():
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'done', checksums = ?, lease_expires = NULL, error = NULL, updated = ? "
+                "WHERE view_index = ? AND status = 'leased' AND worker = ?",
+                (json.dumps(checksums), time.time(), view_index, worker),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, worker, view_index, error):
+        """Return a failed view to the queue, or mark it failed once it hit the retry limit."""
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_expires = NULL, error = ?, updated = ? "
+                "WHERE view_index = ? AND status = 'leased' AND worker = ?",
+                (self.max_attempts, str(error), time.time(), view_index, worker),
+            )
+
+    def release(self, worker):
+        """Give back every lease of a worker without counting it as an attempt."""
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, attempts = attempts - 1, "
+                "updated = ? WHERE status = 'leased' AND worker = ?",
+                (time.time(), worker),
+            )
+
+    def leased_indices(self, worker):
+        """Return the indices of the views a worker holds leases on."""
+        rows = self.connection.execute(
+            "SELECT view_index FROM jobs WHERE status = 'leased' AND worker = ?", (worker,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def leased_by_others(self, worker):
+        """Return the number of views leased to workers other than the given one."""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND worker != ?", (worker,)
+        ).fetchone()[0]
+
+    def done_indices(self):
+        """Return the indices of the finished views."""
+        rows = self.connection.execute("SELECT view_index FROM jobs WHERE status = 'done'").fetchall()
+        return {row[0] for row in rows}
+
+    def counts(self):
+        """Return the number of views in each status."""
+        rows = self.connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        self.connection.close()
+
+
+class _ImmediateTransaction:
+    """Context manager running a block in a BEGIN IMMEDIATE transaction."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class LeaseHeartbeat:
+    """Background thread that keeps a worker's leases alive while it renders."""
+
+    def __init__(self, db_path, worker, lease_seconds=900, max_attempts=3):
+        self.db_path = db_path
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='LeaseHeartbeat', daemon=True)
+
+    def _run(self):
+        # sqlite connections can't be shared between threads, so open a separate one
+        queue = JobQueue(self.db_path, self.lease_seconds, self.max_attempts)
+        try:
+            while not self.stop_event.wait(self.lease_seconds / 3):
+                try:
+                    queue.heartbeat(self.worker)
+                except sqlite3.OperationalError as e:
+                    print(f"Lease heartbeat failed: {e}")
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+class QueueJournal:
+    """Completion journal interface backed by the queue, for render_camera_from_vertices.
+
+    Views recorded as finished are marked done in the queue together with the
+    checksums of their output files.
+    """
+
+    def __init__(self, queue, worker, output_dir):
+        self.queue = queue
+        self.worker = worker
+        self.output_dir = output_dir
+        self.local = threading.local()
+
+    def _thread_queue(self):
+        """Return a queue connection usable from the calling thread (e.g. an output writer)."""
+        if threading.current_thread() is threading.main_thread():
+            return self.queue
+        if not hasattr(self.local, 'queue'):
+            self.local.queue = JobQueue(self.queue.db_path, self.queue.lease_seconds, self.queue.max_attempts)
+        return self.local.queue
+
+    def pending(self, view_plan):
+        return list(view_plan)
+
+    def record(self, view, outputs=(), shard_offset=None, shard_size=None, **info):
+        checksums = {}
+        for output in outputs:
+            output_path = os.path.join(self.output_dir, output)
+            if not os.path.isfile(output_path):
+                continue
+            if shard_offset is not None:
+                # Shards are still being written, so check the view's own sample only
+                checksums[output] = file_checksum(output_path, shard_offset, shard_size)
+            else:
+                checksums[output] = file_checksum(output_path)
+        if not self._thread_queue().complete(self.worker, view['index'], checksums):
+            print(f"Lost the lease on {view['name']} before it finished, another worker may render it again")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the render job queue")
+    parser.add_argument('command', choices=['init', 'status'])
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--run-dir', help="run folder with view_plan.json (for init)")
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.db)
+    if args.command == 'init':
+        if not args.run_dir:
+            parser.error("init needs --run-dir")
+        queue.add_plan(ViewPlan.load(args.run_dir))
+    print(queue.counts())
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
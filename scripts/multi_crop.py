@@ -0,0 +1,202 @@
+"""Cut several jittered fixed-size crops around the annotated vertices out of every rendered view.
+
+Example:
+    python multi_crop.py generated_data/Abby/run1 --output generated_data/Abby/run1_crops \\
+        --crops 8 --size 256 --scale-jitter 0.15 --shift-jitter 0.1 --workers 8
+
+Runs outside of Blender on a process pool. Crops are written as tar shards
+(see shards.py) into <output>/shards, with the annotation arrays transformed
+into crop pixels, so dataset_loader.py reads them like any rendered run.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset_loader import list_samples, load_sample
+from output_pipeline import pack_png
+from shards import ShardWriter
+
+
+def crop_box(screen, margin=0.25, scale=1.0, shift=(0.0, 0.0)):
+    """Return the square (x_min, y_min, x_max, y_max) box around screen points.
+
+    The box is the bounding square of the points grown by margin times its
+    size, scaled by scale and moved by shift times its size.
+    """
+    low, high = screen.min(axis=0), screen.max(axis=0)
+    side = max(float((high - low).max()), 1.0) * (1 + 2 * margin) * scale
+    center = (low + high) / 2 + np.asarray(shift) * side
+    return (center[0] - side / 2, center[1] - side / 2, center[0] + side / 2, center[1] + side / 2)
+
+
+def _bilinear_taps(coords, limit):
+    """Return the two source indices and weights per coordinate, with zero weight outside [0, limit)."""
+    low = np.floor(coords).astype(np.intp)
+    frac = coords - low
+    high = low + 1
+    low_weight = (1 - frac) * ((low >= 0) & (low < limit))
+    high_weight = frac * ((high >= 0) & (high < limit))
+    return np.clip(low, 0, limit - 1), np.clip(high, 0, limit - 1), low_weight, high_weight
+
+
+def resample_crop(image, box, size):
+    """Sample the box of an (height, width, channels) image at size x size pixels with bilinear filtering.
+
+    The crop is a separable scale and shift, so rows and columns are
+    interpolated one after the other. Pixels outside the image come out as 0.
+    """
+    x_min, y_min, x_max, y_max = box
+    height, width = image.shape[:2]
+    # Source coordinates of the output pixel centres, with pixel i centred at i
+    xs = x_min + (np.arange(size) + 0.5) * (x_max - x_min) / size - 0.5
+    ys = y_min + (np.arange(size) + 0.5) * (y_max - y_min) / size - 0.5
+    x_low, x_high, wx_low, wx_high = _bilinear_taps(xs, width)
+    y_low, y_high, wy_low, wy_high = _bilinear_taps(ys, height)
+
+    source = image.astype(np.float32)
+    rows = source[y_low] * wy_low[:, None, None] + source[y_high] * wy_high[:, None, None]
+    crop = rows[:, x_low] * wx_low[None, :, None] + rows[:, x_high] * wx_high[None, :, None]
+    return np.clip(crop + 0.5, 0, np.iinfo(image.dtype).max).astype(image.dtype)
+
+
+def transform_points(screen, box, size):
+    """Map full frame pixel coordinates into the pixels of a size x size crop of box."""
+    x_min, y_min, x_max, y_max = box
+    return (screen - np.array([x_min, y_min])) * (size / np.array([x_max - x_min, y_max - y_min]))
+
+
+def make_crops(sample, num_crops, size, scale_jitter=0.15, shift_jitter=0.1, margin=0.25, seed=None):
+    """Cut num_crops jittered crops out of one loaded sample.
+
+    Each crop's scale is drawn log-uniformly within 1 +- scale_jitter and its
+    shift uniformly within +- shift_jitter times its size. Returns
+    (key, png bytes, annotation arrays, metadata) tuples, or [] for views
+    without an image or with no annotated vertex in frame.
+    """
+    image = sample['image']
+    screen = np.asarray(sample['screen'], dtype=np.float64)
+    if image is None or len(screen) == 0:
+        return []
+    if image.dtype != np.uint8:
+        image = (image >> 8).astype(np.uint8)
+
+    # Frame the crops on the visible vertices, or on every vertex in frame if none is visible
+    height, width = image.shape[:2]
+    framed = (screen[:, 0] >= 0) & (screen[:, 0] < width) & (screen[:, 1] >= 0) & (screen[:, 1] < height)
+    anchor = sample['visible'] & framed
+    if not anchor.any():
+        anchor = framed
+    if not anchor.any():
+        return []
+
+    rng = np.random.default_rng(seed)
+    scales = np.exp(rng.uniform(np.log(1 - scale_jitter), np.log(1 + scale_jitter), num_crops))
+    shifts = rng.uniform(-shift_jitter, shift_jitter, (num_crops, 2))
+
+    crops = []
+    for k in range(num_crops):
+        box = crop_box(screen[anchor], margin, scales[k], shifts[k])
+        crop_screen = transform_points(screen, box, size)
+        in_crop = np.all((crop_screen >= 0) & (crop_screen < size), axis=1)
+        arrays = {
+            'vertex_index': np.asarray(sample['vertex_index'], dtype=np.uint32),
+            'world': np.asarray(sample['world'], dtype=np.float32),
+            'screen': crop_screen.astype(np.float32),
+            'visible': (sample['visible'] & in_crop).astype(np.uint8),
+        }
+        if 'group_mask' in sample:
+            arrays['group_mask'] = sample['group_mask']
+        metadata = {
+            # Runs reuse view names, so crops are named after both
+            'view': f"{os.path.basename(os.path.normpath(sample['run_dir']))}_{sample['view']}_crop{k:02d}",
+            'source_view': sample['view'],
+            'source_run': sample['run_dir'],
+            'box': [float(v) for v in box],
+            'scale': float(scales[k]),
+            'shift': [float(v) for v in shifts[k]],
+            'width': size,
+            'height': size,
+        }
+        crops.append((metadata['view'], pack_png(resample_crop(image, box, size)), arrays, metadata))
+    return crops
+
+
+def crop_view(sample_ref, num_crops, size, scale_jitter, shift_jitter, margin, seed):
+    """Load one listed view and cut its crops. Runs on the worker processes."""
+    return make_crops(load_sample(sample_ref), num_crops, size, scale_jitter, shift_jitter, margin, seed)
+
+
+def run_crops(run_dirs, output_dir, num_crops=8, size=256, scale_jitter=0.15, shift_jitter=0.1, margin=0.25,
+              num_workers=4, seed=0, max_pending=None, max_shard_bytes=512 * 1024 * 1024):
+    """Crop every view of the runs into output_dir/shards on num_workers processes. Returns a summary dict.
+
+    Views are handed out at most max_pending (default 2 * num_workers) at a
+    time, and written in order, so the shards are the same for any worker count.
+    """
+    samples = list_samples(run_dirs)
+    max_pending = max_pending or 2 * num_workers
+    start = time.perf_counter()
+    num_crops_written = 0
+    skipped = 0
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor, \
+            ShardWriter(os.path.join(output_dir, 'shards'), max_shard_bytes) as shard_writer:
+        order = iter(enumerate(samples))
+        pending = deque()
+
+        def fill():
+            for index, sample in order:
+                # One seed per view, so a view's crops don't depend on which worker cut them
+                pending.append(executor.submit(crop_view, sample, num_crops, size, scale_jitter, shift_jitter, margin,
+                                               None if seed is None else (seed, index)))
+                if len(pending) >= max_pending:
+                    return
+
+        fill()
+        while pending:
+            crops = pending.popleft().result()
+            fill()
+            if not crops:
+                skipped += 1
+            for key, image_bytes, arrays, metadata in crops:
+                shard_writer.write(key, image_bytes, arrays, metadata)
+            num_crops_written += len(crops)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'views': len(samples),
+        'views_skipped': skipped,
+        'crops': num_crops_written,
+        'elapsed_seconds': elapsed,
+        'crops_per_second': num_crops_written / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"Cut {num_crops_written} crops from {len(samples) - skipped} views in {elapsed:.1f}s "
+          f"({summary['crops_per_second']:.1f} crops/s), {skipped} views without an image or framed vertices")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cut jittered fixed-size crops out of rendered views")
+    parser.add_argument('run_dirs', nargs='+')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--crops', type=int, default=8, help="crops per view")
+    parser.add_argument('--size', type=int, default=256, help="crop width and height in pixels")
+    parser.add_argument('--scale-jitter', type=float, default=0.15)
+    parser.add_argument('--shift-jitter', type=float, default=0.1, help="largest shift, as a fraction of the crop size")
+    parser.add_argument('--margin', type=float, default=0.25, help="space around the vertices, as a fraction of their extent")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    run_crops(args.run_dirs, args.output, args.crops, args.size, args.scale_jitter, args.shift_jitter, args.margin,
+              args.workers, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
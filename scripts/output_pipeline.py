@@ -0,0 +1,129 @@
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# PNG color type by channel count: gray, gray + alpha, RGB, RGBA
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+def linear_to_srgb(linear):
+    """Apply the sRGB transfer curve, matching Blender's 'Standard' view transform."""
+    linear = np.clip(linear, 0.0, 1.0)
+    return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * np.power(linear, 1 / 2.4) - 0.055)
+
+
+def encode_png(pixels, compress_level=6):
+    """Encode a linear float (height, width, 4) buffer with bottom-up rows as 8 bit RGBA PNG bytes."""
+    height, width, _ = pixels.shape
+    rgba = np.empty((height, width, 4), dtype=np.float32)
+    rgba[:, :, :3] = linear_to_srgb(pixels[:, :, :3])
+    rgba[:, :, 3] = np.clip(pixels[:, :, 3], 0.0, 1.0)
+    return pack_png((rgba[::-1] * 255 + 0.5).astype(np.uint8), compress_level)
+
+
+def pack_png(pixels, compress_level=6):
+    """Encode a uint8 (height, width, channels) array with top-down rows as PNG bytes, with 1 to 4 channels."""
+    height, width, channels = pixels.shape
+
+    # Every scanline starts with filter type 0 (None)
+    raw = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * channels)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', header),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)),
+        chunk(b'IEND', b''),
+    ])
+
+
+class OutputPipeline:
+    """Bounded pool of writer threads for the per-view output stage.
+
+    The render loop hands over plain Python / NumPy data and goes on with the
+    next render while the writers encode and write files. At most max_pending
+    views are queued or being written; submit() blocks beyond that, so slow
+    writers hold the render loop back instead of piling up memory. Tasks must
+    never touch bpy. Use sink_lock around writes to shared sinks (annotation
+    store, tar shards, journal).
+
+    Each task carries a context (e.g. the view it writes). A failed task is
+    passed to on_error(context, error) on the main thread, or re-raised there
+    once if on_error is None.
+    """
+
+    def __init__(self, num_workers=2, max_pending=4, on_error=None):
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='OutputWriter')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.sink_lock = threading.Lock()
+        self.on_error = on_error
+        # (future, context) pairs of the tasks not checked yet
+        self.futures = []
+        self.blocked_seconds = 0.0
+
+    def _handle_errors(self, finished):
+        """Pass the errors of finished tasks to on_error, or raise the first one."""
+        first_error = None
+        for future, context in finished:
+            error = future.exception()
+            if error is None:
+                continue
+            if self.on_error is not None:
+                self.on_error(context, error)
+            elif first_error is None:
+                first_error = error
+        if first_error is not None:
+            raise first_error
+
+    def _check_errors(self):
+        """Handle the errors of finished tasks on the main thread, each one only once."""
+        finished, still_running = [], []
+        for task in self.futures:
+            (finished if task[0].done() else still_running).append(task)
+        self.futures = still_running
+        self._handle_errors(finished)
+
+    def submit(self, fn, *args, context=None, **kwargs):
+        """Queue a write task, waiting for a free slot if the writers are behind. Returns the seconds waited."""
+        self._check_errors()
+        start = time.perf_counter()
+        self.slots.acquire()
+        waited = time.perf_counter() - start
+        self.blocked_seconds += waited
+
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append((future, context))
+        return waited
+
+    def flush(self):
+        """Wait for every queued write and handle their errors."""
+        futures, self.futures = self.futures, []
+        for future, _ in futures:
+            # exception() waits without raising, so every write finishes before an error is raised
+            future.exception()
+        self._handle_errors(futures)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
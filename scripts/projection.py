@@ -0,0 +1,117 @@
+import numpy as np
+
+
+def mesh_local_coords(mesh_data):
+    """Read all vertex coordinates of a mesh into an (N, 3) float32 array."""
+    coords = np.empty(len(mesh_data.vertices) * 3, dtype=np.float32)
+    mesh_data.vertices.foreach_get('co', coords)
+    return coords.reshape(-1, 3)
+
+
+def matrix_to_array(matrix):
+    """Convert a mathutils Matrix to a NumPy array."""
+    return np.array([tuple(row) for row in matrix], dtype=np.float64)
+
+
+def transform_points(matrix, points):
+    """Apply a 4x4 transform to an (N, 3) array of points."""
+    mat = matrix_to_array(matrix)
+    return points @ mat[:3, :3].T + mat[:3, 3]
+
+
+def mesh_world_coords(mesh_obj, indices=None):
+    """Return world space coordinates of the mesh vertices (optionally a subset)."""
+    local_co = mesh_local_coords(mesh_obj.data)
+    if indices is not None:
+        local_co = local_co[indices]
+    return transform_points(mesh_obj.matrix_world, local_co)
+
+
+def mesh_world_normals(mesh_obj, indices=None):
+    """Return unit world space vertex normals of the mesh (optionally a subset)."""
+    mesh_data = mesh_obj.data
+    normals = np.empty(len(mesh_data.vertices) * 3, dtype=np.float32)
+    mesh_data.vertices.foreach_get('normal', normals)
+    normals = normals.reshape(-1, 3)
+    if indices is not None:
+        normals = normals[indices]
+    return transform_normals(mesh_obj.matrix_world, normals)
+
+
+def transform_normals(matrix, normals):
+    """Transform an (N, 3) array of normals by a 4x4 object matrix and normalize them."""
+    # Normals transform with the inverse transpose of the object matrix
+    normal_matrix = np.linalg.inv(matrix_to_array(matrix)[:3, :3]).T
+    world_normals = normals @ normal_matrix.T
+    lengths = np.linalg.norm(world_normals, axis=1, keepdims=True)
+    return world_normals / np.maximum(lengths, 1e-12)
+
+
+def render_size(scene):
+    """Return the final render size in pixels, taking resolution percentage into account."""
+    render_scale = scene.render.resolution_percentage / 100
+    return (
+        int(scene.render.resolution_x * render_scale),
+        int(scene.render.resolution_y * render_scale),
+    )
+
+
+def world_to_camera_view_array(scene, cam_obj, world_co):
+    """Vectorized version of bpy_extras.object_utils.world_to_camera_view.
+
+    Returns an (N, 3) array of normalized camera coordinates: x and y are 0..1
+    inside the camera frame (origin bottom left) and z is the depth along the
+    camera view axis, exactly like the per-vertex function.
+    """
+    co_local = transform_points(cam_obj.matrix_world.normalized().inverted(), world_co)
+    z = -co_local[:, 2]
+
+    camera = cam_obj.data
+    frame = np.array([tuple(v) for v in camera.view_frame(scene=scene)[:3]], dtype=np.float64)
+
+    if camera.type != 'ORTHO':
+        # Scale the view frame onto the plane of each point, as world_to_camera_view does
+        with np.errstate(divide='ignore', invalid='ignore'):
+            min_x = -frame[2, 0] * z / frame[2, 2]
+            max_x = -frame[1, 0] * z / frame[1, 2]
+            min_y = -frame[1, 1] * z / frame[1, 2]
+            max_y = -frame[0, 1] * z / frame[0, 2]
+            x = (co_local[:, 0] - min_x) / (max_x - min_x)
+            y = (co_local[:, 1] - min_y) / (max_y - min_y)
+        on_camera_plane = z == 0.0
+        x[on_camera_plane] = 0.5
+        y[on_camera_plane] = 0.5
+    else:
+        min_x, max_x = frame[2, 0], frame[1, 0]
+        min_y, max_y = frame[1, 1], frame[0, 1]
+        x = (co_local[:, 0] - min_x) / (max_x - min_x)
+        y = (co_local[:, 1] - min_y) / (max_y - min_y)
+
+    return np.column_stack((x, y, z))
+
+
+def ndc_to_screen(scene, co_ndc):
+    """Convert normalized camera coordinates to pixel coordinates (origin top left)."""
+    width, height = render_size(scene)
+    screen = np.empty((len(co_ndc), 2), dtype=np.float64)
+    screen[:, 0] = co_ndc[:, 0] * width
+    screen[:, 1] = (1 - co_ndc[:, 1]) * height
+    return screen
+
+
+def project_vertices(scene, cam_obj, mesh_obj, indices=None, world_co=None):
+    """Project mesh vertices for one view in a single call.
+
+    Returns (world_co, screen_xy, co_ndc) arrays matching what
+    world_space_to_screen_space and world_to_camera_view give per vertex.
+    Pass world_co to project precomputed world space positions of those
+    vertices (e.g. of the evaluated mesh) instead of reading the mesh.
+    """
+    if not cam_obj or cam_obj.type != 'CAMERA':
+        raise ValueError(f"Camera '{getattr(cam_obj, 'name', cam_obj)}' not found or is not a valid camera object.")
+
+    if world_co is None:
+        world_co = mesh_world_coords(mesh_obj, indices)
+    co_ndc = world_to_camera_view_array(scene, cam_obj, world_co)
+    screen_xy = ndc_to_screen(scene, co_ndc)
+    return world_co, screen_xy, co_ndc
@@ -0,0 +1,180 @@
+"""Recompute annotations of a rendered run with several background Blender processes, without rendering.
+
+Example:
+    python reannotate.py --blend batch.blend --run-dir generated_data/Abby/run1 --label head_tight \\
+        --group Head Hand_L Hand_R --tolerance 0.0001 --workers 8
+
+Results go to <run dir>/reannotated/<label>/worker_XX. Camera poses come from
+the run's view plan, or from the shard metadata of runs without one.
+--command works like in render_farm.py.
+"""
+import argparse
+import glob
+import os
+import shlex
+import subprocess
+import sys
+import time
+from itertools import chain
+
+from render_farm import base_command
+from shards import iter_samples, read_index
+from view_plan import ViewPlan, CompletionJournal, JOURNAL_FILE
+
+REANNOTATED_DIR = 'reannotated'
+
+
+def label_dir(run_dir, label):
+    return os.path.join(run_dir, REANNOTATED_DIR, label)
+
+
+def worker_output_dir(run_dir, label, worker):
+    """Return the directory a re-annotation worker writes its annotations and journal to."""
+    return os.path.join(label_dir(run_dir, label), f'worker_{worker:02d}')
+
+
+def _shard_dirs(shard_dir):
+    """Return a shard folder and the worker_* folders collected into it."""
+    return [shard_dir] + sorted(glob.glob(os.path.join(shard_dir, 'worker_*')))
+
+
+def _shard_views(shard_dir):
+    """Return the views stored in a shard folder and its worker_* folders, with camera poses and ROI from their metadata."""
+    views = []
+    for sample in chain.from_iterable(iter_samples(path) for path in _shard_dirs(shard_dir)):
+        metadata = sample['metadata']
+        views.append({
+            'index': int(metadata['view'].rsplit('_', 1)[-1]),
+            'name': metadata['view'],
+            'location': metadata['camera_location'],
+            'rotation': metadata['camera_rotation'],
+            'hdri': metadata['hdri'],
+            'strength': metadata['background_strength'],
+            'roi': metadata.get('roi'),
+            'roi_cropped': metadata.get('roi_cropped', False),
+        })
+    return views
+
+
+def _rendered_names(run_dir):
+    """Return the names of the views whose image is on disk, as a PNG or as a shard sample."""
+    names = {os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(run_dir, '*.png'))}
+    for path in _shard_dirs(os.path.join(run_dir, 'shards')):
+        names.update(row['key'] for row in read_index(path))
+    return names
+
+
+def recorded_views(run_dir):
+    """Return the rendered views of a run with their recorded camera poses.
+
+    Views of runs rendered with ROI_CROP also carry the roi box their image
+    was cropped to, and roi_cropped, so the annotations can be cropped alike.
+    """
+    shard_dir = os.path.join(run_dir, 'shards')
+    if ViewPlan.exists(run_dir):
+        plan = ViewPlan.load(run_dir)
+        records = {record['index']: record for record in CompletionJournal(run_dir).records}
+        if records:
+            views = []
+            for view in plan.views:
+                record = records.get(view['index'])
+                if record is not None:
+                    views.append(dict(view, roi=record.get('roi'), roi_cropped=record.get('roi_cropped', False)))
+        elif plan.settings.get('roi_crop'):
+            # Queue runs keep their progress in the queue, so the crop boxes can only come from the shards
+            if not os.path.isdir(shard_dir):
+                raise ValueError(f"{run_dir} was rendered with ROI_CROP, but its crop boxes are neither in a journal nor in shards")
+            views = _shard_views(shard_dir)
+        else:
+            # Queue runs have no journal, so only views whose image made it to disk were rendered
+            rendered = _rendered_names(run_dir)
+            views = [view for view in plan.views if view['name'] in rendered]
+        return views
+
+    if os.path.isdir(shard_dir):
+        return _shard_views(shard_dir)
+
+    raise FileNotFoundError(f"{run_dir} has neither a view plan nor shards to read camera poses from")
+
+
+def completed_views(run_dir, label):
+    """Return the indices re-annotated by any worker so far."""
+    completed = set()
+    for journal_path in glob.glob(os.path.join(label_dir(run_dir, label), '*', JOURNAL_FILE)):
+        completed |= CompletionJournal(os.path.dirname(journal_path)).completed()
+    return completed
+
+
+def run_reannotation(command, run_dir, label, num_workers, worker_args=()):
+    """Re-annotate every recorded view of a run with num_workers processes. Returns a summary dict."""
+    total = len(recorded_views(run_dir))
+    done_before = len(completed_views(run_dir, label))
+
+    start = time.time()
+    processes = []
+    for worker in range(num_workers):
+        output_dir = worker_output_dir(run_dir, label, worker)
+        os.makedirs(output_dir, exist_ok=True)
+        args = ['--', '--run-dir', run_dir, '--worker', str(worker), '--num-workers', str(num_workers),
+                '--reannotate', label] + list(worker_args)
+        log_file = open(os.path.join(output_dir, 'log.txt'), 'a')
+        processes.append((worker, subprocess.Popen(command + args, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+
+    failed = []
+    for worker, process, log_file in processes:
+        if process.wait() != 0:
+            failed.append(worker)
+            print(f"Worker {worker} failed, see {os.path.join(worker_output_dir(run_dir, label, worker), 'log.txt')}")
+        log_file.close()
+    elapsed = time.time() - start
+
+    done = len(completed_views(run_dir, label))
+    processed = done - done_before
+    summary = {
+        'views_processed': processed,
+        'views_done': done,
+        'views_recorded': total,
+        'workers': num_workers,
+        'failed_workers': failed,
+        'elapsed_seconds': elapsed,
+        'views_per_second': processed / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"Re-annotated {processed} views in {elapsed:.1f}s with {num_workers} workers "
+          f"({summary['views_per_second']:.2f} views/s), {done}/{total} views done")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute annotations of a rendered run without rendering")
+    parser.add_argument('--run-dir', required=True)
+    parser.add_argument('--label', required=True, help="name of this annotation set, e.g. the landmark set")
+    parser.add_argument('--group', nargs='+', help="vertex groups to annotate, several are annotated in one pass")
+    parser.add_argument('--visibility-mode', choices=['raycast', 'tiered'])
+    parser.add_argument('--tolerance', type=float, help="ray cast hit tolerance (VISIBILITY_TOLERANCE)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument('--blender', default='blender')
+    parser.add_argument('--blend', help=".blend file with the subject")
+    parser.add_argument('--command', help="worker command to run instead of blender")
+    args = parser.parse_args(argv)
+
+    if args.command:
+        command = shlex.split(args.command)
+    elif args.blend:
+        command = base_command(args.blender, args.blend)
+    else:
+        parser.error("--blend or --command is required")
+
+    worker_args = []
+    if args.group:
+        worker_args += ['--group'] + args.group
+    if args.visibility_mode:
+        worker_args += ['--visibility-mode', args.visibility_mode]
+    if args.tolerance is not None:
+        worker_args += ['--tolerance', str(args.tolerance)]
+
+    summary = run_reannotation(command, args.run_dir, args.label, args.workers, worker_args)
+    return 1 if summary['failed_workers'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Render a view plan with several background Blender processes on one machine.
+
+Example:
+    python render_farm.py --blend batch.blend --run-dir generated_data/Abby/run1 --workers 4 --threads 8
+
+--command replaces the 'blender -b <blend> -P render_worker.py' part, so the
+driver can be exercised with a fake worker when Blender is not installed.
+"""
+import argparse
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+
+from annotation_store import merge_store
+from catalog import Catalog, index_run
+from render_trace import TRACE_FILE
+from shards import merge_shards
+from view_plan import ViewPlan, CompletionJournal, JOURNAL_FILE
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_SCRIPT = os.path.join(SCRIPT_DIR, 'render_worker.py')
+WORKERS_DIR = 'workers'
+
+
+def default_catalog(run_dir):
+    """Return the catalog Render_Cached.py writes to for a run, next to the subject folders."""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(run_dir))), 'catalog.sqlite')
+
+
+def worker_dir(run_dir, worker):
+    """Return the directory a worker writes its outputs to before they are collected."""
+    return os.path.join(run_dir, WORKERS_DIR, f'worker_{worker:02d}')
+
+
+def base_command(blender, blend_file):
+    return [blender, '-b', blend_file, '-P', WORKER_SCRIPT]
+
+
+def run_plan_step(command, run_dir):
+    """Have one worker write the view plan, if the run does not have one yet."""
+    if ViewPlan.exists(run_dir):
+        return
+    subprocess.run(command + ['--', '--run-dir', run_dir, '--plan-only'], check=True)
+    if not ViewPlan.exists(run_dir):
+        raise RuntimeError(f"Plan step finished but no view plan was written to {run_dir}")
+
+
+def launch_workers(command, run_dir, num_workers, threads, device):
+    """Start one worker process per shard, each logging to its own folder."""
+    processes = []
+    for worker in range(num_workers):
+        output_dir = worker_dir(run_dir, worker)
+        os.makedirs(output_dir, exist_ok=True)
+        args = ['--', '--run-dir', run_dir, '--worker', str(worker), '--num-workers', str(num_workers),
+                '--threads', str(threads), '--device', device]
+        log_file = open(os.path.join(output_dir, 'log.txt'), 'a')
+        process = subprocess.Popen(command + args, stdout=log_file, stderr=subprocess.STDOUT)
+        processes.append((worker, process, log_file))
+        print(f"Started worker {worker} (pid {process.pid})")
+    return processes
+
+
+def collect_outputs(run_dir, num_workers):
+    """Move worker outputs into the run directory and merge their journals into the run journal.
+
+    Files land next to view_plan.json, and sub folders of a worker (columnar
+    annotations, tar shards) land in <folder>/worker_XX so they don't clash.
+    Shards and stores collected by an earlier pass are kept: new shards are
+    numbered after them, new store rows are appended after theirs.
+    Worker traces are appended to the run's trace.jsonl. Returns the number of views collected.
+    """
+    run_journal = CompletionJournal(run_dir)
+    completed = run_journal.completed()
+    collected = 0
+
+    for worker in range(num_workers):
+        output_dir = worker_dir(run_dir, worker)
+        if not os.path.isdir(output_dir):
+            continue
+        worker_journal = CompletionJournal(output_dir)
+
+        for name in os.listdir(output_dir):
+            if name in (JOURNAL_FILE, 'log.txt'):
+                continue
+            source = os.path.join(output_dir, name)
+            if name == TRACE_FILE:
+                with open(source, 'rb') as f:
+                    trace = f.read()
+                if trace and not trace.endswith(b'\n'):
+                    # Drop the torn last record of a worker that crashed mid-write
+                    trace = trace[:trace.rfind(b'\n') + 1]
+                with open(os.path.join(run_dir, TRACE_FILE), 'ab') as f:
+                    f.write(trace)
+                os.remove(source)
+                continue
+            if os.path.isdir(source):
+                # Merge into what earlier passes of a resumed run collected, their views are in the run journal
+                destination = os.path.join(run_dir, name, f'worker_{worker:02d}')
+                if name == 'shards':
+                    merge_shards(source, destination)
+                elif name == 'annotations':
+                    merge_store(source, destination)
+                else:
+                    shutil.copytree(source, destination, dirs_exist_ok=True)
+                shutil.rmtree(source)
+            else:
+                os.replace(source, os.path.join(run_dir, name))
+
+        for record in worker_journal.records:
+            if record['index'] in completed:
+                continue
+            record['worker'] = worker
+            run_journal.records.append(record)
+            completed.add(record['index'])
+            collected += 1
+
+        # Merge the journal before dropping the worker's copy, so no completed view is lost
+        run_journal.save()
+        if os.path.exists(worker_journal.file_path):
+            os.remove(worker_journal.file_path)
+
+    return collected
+
+
+def run_farm(command, run_dir, num_workers, threads=0, device='CPU', catalog_db=None):
+    """Render every pending view of a run with num_workers processes. Returns a summary dict.
+
+    Workers don't write to the catalog, since their outputs move when they
+    are collected. The run is indexed into catalog_db once its outputs are collected.
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    run_plan_step(command, run_dir)
+    view_plan = ViewPlan.load(run_dir)
+
+    start = time.time()
+    processes = launch_workers(command, run_dir, num_workers, threads, device)
+    failed = []
+    for worker, process, log_file in processes:
+        return_code = process.wait()
+        log_file.close()
+        if return_code != 0:
+            failed.append(worker)
+            print(f"Worker {worker} exited with code {return_code}, see {os.path.join(worker_dir(run_dir, worker), 'log.txt')}")
+    elapsed = time.time() - start
+
+    collected = collect_outputs(run_dir, num_workers)
+    if catalog_db:
+        with Catalog(catalog_db) as catalog:
+            indexed = index_run(catalog, os.path.abspath(run_dir))
+        print(f"Indexed {indexed} views of {run_dir} in {catalog_db}")
+    completed = len(CompletionJournal(run_dir).completed())
+    summary = {
+        'views_rendered': collected,
+        'views_completed': completed,
+        'views_planned': len(view_plan),
+        'workers': num_workers,
+        'failed_workers': failed,
+        'elapsed_seconds': elapsed,
+        'views_per_hour': collected / elapsed * 3600 if elapsed > 0 else 0.0,
+    }
+    print(f"Rendered {collected} views in {elapsed:.1f}s with {num_workers} workers "
+          f"({summary['views_per_hour']:.1f} views/hour), {completed}/{len(view_plan)} views done")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a view plan with several background Blender processes")
+    parser.add_argument('--run-dir', required=True)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 8))
+    parser.add_argument('--threads', type=int, default=0, help="Cycles threads per worker, 0 = all cores")
+    parser.add_argument('--device', default='CPU', choices=['CPU', 'GPU'])
+    parser.add_argument('--blender', default='blender')
+    parser.add_argument('--blend', help=".blend file to render")
+    parser.add_argument('--command', help="worker command to run instead of blender, e.g. 'python fake_worker.py'")
+    parser.add_argument('--catalog', help="catalog to index the run into after collecting "
+                                          "(default: catalog.sqlite next to the subject folders)")
+    args = parser.parse_args(argv)
+
+    if args.command:
+        command = shlex.split(args.command)
+    elif args.blend:
+        command = base_command(args.blender, args.blend)
+    else:
+        parser.error("--blend or --command is required")
+
+    summary = run_farm(command, args.run_dir, args.workers, args.threads, args.device,
+                       args.catalog or default_catalog(args.run_dir))
+    return 1 if summary['failed_workers'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+
+import numpy as np
+
+from projection import render_size
+from visibility import in_frustum
+
+
+def region_of_interest(scene, cam_obj, co_ndc, margin=0.1, min_size=32):
+    """Return the pixel box (x_min, y_min, x_max, y_max) around the framed vertices, or None if none are framed.
+
+    Rows count from the top, like the screen coordinates of the annotations.
+    The box grows by margin times its size on every side, is at least
+    min_size pixels wide and high where the frame allows, and is clipped to
+    the frame. Returns None as well when the box covers the whole frame.
+    """
+    width, height = render_size(scene)
+    framed = in_frustum(co_ndc, cam_obj.data.clip_start, cam_obj.data.clip_end)
+    if not framed.any():
+        return None
+
+    x = co_ndc[framed, 0] * width
+    y = (1 - co_ndc[framed, 1]) * height
+    box = []
+    for low, high, size in ((x.min(), x.max(), width), (y.min(), y.max(), height)):
+        pad = max((high - low) * margin, (min_size - (high - low)) / 2, 0.0)
+        box.append((max(0, int(np.floor(low - pad))), min(size, int(np.ceil(high + pad)))))
+    (x_min, x_max), (y_min, y_max) = box
+    if (x_min, y_min, x_max, y_max) == (0, 0, width, height):
+        return None
+    return x_min, y_min, x_max, y_max
+
+
+def region_pixels(box):
+    x_min, y_min, x_max, y_max = box
+    return (x_max - x_min) * (y_max - y_min)
+
+
+def set_render_border(scene, box, crop=False):
+    """Render only the pixel box given by region_of_interest from now on, or the whole frame for None."""
+    render = scene.render
+    if box is None:
+        render.use_border = False
+        return
+    width, height = render_size(scene)
+    x_min, y_min, x_max, y_max = box
+    # Blender's border counts rows from the bottom, in fractions of the frame
+    render.border_min_x, render.border_max_x = x_min / width, x_max / width
+    render.border_min_y, render.border_max_y = 1 - y_max / height, 1 - y_min / height
+    render.use_border = True
+    render.use_crop_to_border = crop
+
+
+@contextmanager
+def render_border(scene, box, crop=False):
+    """Render only the pixel box given by region_of_interest within the block, or the whole frame for None.
+
+    With crop, the image is cropped to the box, otherwise it keeps the frame
+    size with empty pixels outside the box. The old border settings are restored afterwards.
+    """
+    render = scene.render
+    saved = (render.use_border, render.use_crop_to_border,
+             render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y)
+    if box is not None:
+        set_render_border(scene, box, crop)
+    try:
+        yield
+    finally:
+        (render.use_border, render.use_crop_to_border,
+         render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y) = saved
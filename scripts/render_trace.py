@@ -0,0 +1,186 @@
+"""Per-stage timing of the render loop, written as one JSON line per view.
+
+Summary of a run:
+    python render_trace.py summary generated_data/Abby/run1
+"""
+import argparse
+import ctypes
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TRACE_FILE = 'trace.jsonl'
+PERCENTILES = (50, 90, 99)
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [
+        ('cb', ctypes.c_uint32),
+        ('PageFaultCount', ctypes.c_uint32),
+        ('PeakWorkingSetSize', ctypes.c_size_t),
+        ('WorkingSetSize', ctypes.c_size_t),
+        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+        ('PagefileUsage', ctypes.c_size_t),
+        ('PeakPagefileUsage', ctypes.c_size_t),
+    ]
+
+
+def peak_memory_bytes():
+    """Return the peak resident memory of this process in bytes, or None if it can't be read."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if sys.platform == 'win32':
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.kernel32.K32GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+class ViewTrace:
+    """Stage durations and counters of one view.
+
+    Stages entered more than once add up. Spans may be recorded from the
+    output writer threads while the main thread renders the next view.
+    """
+
+    def __init__(self, view, kind='view'):
+        self.view = view
+        self.kind = kind
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def to_record(self):
+        with self.lock:
+            return {
+                'view': self.view,
+                'kind': self.kind,
+                'time': time.time(),
+                'total': time.perf_counter() - self.start,
+                'stages': dict(self.stages),
+                'counters': dict(self.counters),
+                'peak_memory': peak_memory_bytes(),
+            }
+
+
+class RunTrace:
+    """Appends ViewTrace records to trace.jsonl in an output directory."""
+
+    def __init__(self, output_dir):
+        self.file_path = os.path.join(output_dir, TRACE_FILE)
+        self.lock = threading.Lock()
+
+    def view(self, view):
+        return ViewTrace(view)
+
+    def write(self, view_trace):
+        line = json.dumps(view_trace.to_record()) + '\n'
+        with self.lock:
+            with open(self.file_path, 'a') as f:
+                f.write(line)
+
+
+def read_trace(path):
+    """Return the records of a trace file, or of the trace.jsonl in a run directory."""
+    if os.path.isdir(path):
+        path = os.path.join(path, TRACE_FILE)
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            # A run killed mid write can leave half a line behind
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def summarize(records):
+    """Return {stage: {'views', 'mean', 'p50', 'p90', 'p99', 'total'}} over the records.
+
+    'total' is the wall time of whole views, from the start of the view until its outputs were written.
+    """
+    durations = {}
+    for record in records:
+        for stage, seconds in record['stages'].items():
+            durations.setdefault(stage, []).append(seconds)
+        if record.get('kind', 'view') == 'view':
+            durations.setdefault('total', []).append(record['total'])
+
+    summary = {}
+    for stage, values in durations.items():
+        values = np.asarray(values)
+        summary[stage] = {'views': len(values), 'mean': float(values.mean()), 'total': float(values.sum())}
+        for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            summary[stage][f'p{q}'] = float(value)
+    return summary
+
+
+def print_summary(records):
+    summary = summarize(records)
+    columns = ['views', 'mean'] + [f'p{q}' for q in PERCENTILES] + ['total']
+    print(f"{'stage':<20}" + ''.join(f"{column:>10}" for column in columns))
+    for stage, stats in sorted(summary.items(), key=lambda item: -item[1]['total']):
+        print(f"{stage:<20}{stats['views']:>10}" + ''.join(f"{stats[column]:>10.3f}" for column in columns[1:]))
+
+    counters = {}
+    for record in records:
+        for name, value in record['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    for name, value in sorted(counters.items()):
+        print(f"{name}: {value}")
+    peaks = [record['peak_memory'] for record in records if record.get('peak_memory')]
+    if peaks:
+        print(f"peak memory: {max(peaks) / 1024 ** 2:.0f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect render loop traces")
+    parser.add_argument('command', choices=['summary'])
+    parser.add_argument('path', help="trace.jsonl or the run folder containing it")
+    args = parser.parse_args(argv)
+
+    records = read_trace(args.path)
+    if not records:
+        print(f"No trace records in {args.path}")
+        return
+    print_summary(records)
+
+
+if __name__ == "__main__":
+    main()
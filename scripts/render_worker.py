@@ -0,0 +1,101 @@
+"""Blender side of render_farm.py.
+
+Run as: blender -b file.blend -P render_worker.py -- --run-dir DIR --worker K --num-workers N --threads T
+or with --plan-only to just write the view plan of DIR, or with --reannotate LABEL
+to recompute the annotations of the rendered views (see reannotate.py).
+"""
+import argparse
+import os
+import sys
+
+import bpy
+
+# Make the helper modules next to this script importable from Blender
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+
+import Render_Cached
+from render_farm import worker_dir
+from reannotate import recorded_views, completed_views, worker_output_dir
+from view_plan import ViewPlan, CompletionJournal
+
+
+def parse_args():
+    """Parse the arguments after '--' on the Blender command line."""
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description="Render one shard of a view plan")
+    parser.add_argument('--run-dir', required=True)
+    parser.add_argument('--worker', type=int, default=0)
+    parser.add_argument('--num-workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=0, help="Cycles threads, 0 = all cores")
+    parser.add_argument('--device', default='CPU', choices=['CPU', 'GPU'])
+    parser.add_argument('--plan-only', action='store_true')
+    parser.add_argument('--reannotate', metavar='LABEL', help="recompute annotations into reannotated/LABEL instead of rendering")
+    parser.add_argument('--group', nargs='+', help="vertex groups to annotate (default: VERTEX_GROUP_NAMES or VERTEX_GROUP_NAME)")
+    parser.add_argument('--visibility-mode', choices=['raycast', 'tiered'])
+    parser.add_argument('--tolerance', type=float, help="ray cast hit tolerance (VISIBILITY_TOLERANCE)")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.run_dir, exist_ok=True)
+
+    if args.plan_only:
+        Render_Cached.setup_scene()
+        view_plan = Render_Cached.load_or_build_plan(args.run_dir)
+        print(f"Wrote plan with {len(view_plan)} views to {args.run_dir}")
+        return
+
+    if args.reannotate:
+        reannotate(args)
+        return
+
+    output_dir = worker_dir(args.run_dir, args.worker)
+    os.makedirs(output_dir, exist_ok=True)
+    # The render loop writes to OUTPUT_DIR, point it at this worker's folder
+    Render_Cached.OUTPUT_DIR = output_dir
+    # Rows written here would point into the worker folder, render_farm.py indexes the run once it is collected
+    Render_Cached.CATALOG_DB = None
+
+    camera, target_obj = Render_Cached.setup_scene()
+    scene = bpy.context.scene
+    scene.cycles.device = args.device
+    if args.threads > 0:
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = args.threads
+
+    # Views collected from earlier farm runs are in the run journal, not the worker's own
+    view_plan = ViewPlan.load(args.run_dir)
+    collected = CompletionJournal(args.run_dir).completed()
+    views = [view for view in view_plan.views[args.worker::args.num_workers] if view['index'] not in collected]
+    shard = ViewPlan(views, view_plan.seed, view_plan.settings)
+    print(f"Worker {args.worker}/{args.num_workers}: {len(shard)} views, {args.threads or 'all'} threads")
+
+    journal = CompletionJournal(output_dir)
+    vertex_groups = Render_Cached.VERTEX_GROUP_NAMES or Render_Cached.VERTEX_GROUP_NAME
+    Render_Cached.render_camera_from_vertices(camera, shard, journal, vertex_groups, target_obj)
+
+
+def reannotate(args):
+    """Recompute the annotations of this worker's share of the rendered views, without rendering."""
+    output_dir = worker_output_dir(args.run_dir, args.reannotate, args.worker)
+    os.makedirs(output_dir, exist_ok=True)
+    Render_Cached.OUTPUT_DIR = output_dir
+    if args.visibility_mode:
+        Render_Cached.VISIBILITY_MODE = args.visibility_mode
+    if args.tolerance is not None:
+        Render_Cached.VISIBILITY_TOLERANCE = args.tolerance
+    vertex_group_name = args.group or Render_Cached.VERTEX_GROUP_NAMES or Render_Cached.VERTEX_GROUP_NAME
+
+    camera, target_obj = Render_Cached.setup_scene()
+    completed = completed_views(args.run_dir, args.reannotate)
+    views = [view for view in recorded_views(args.run_dir)[args.worker::args.num_workers] if view['index'] not in completed]
+    print(f"Worker {args.worker}/{args.num_workers}: re-annotating {len(views)} views with groups {vertex_group_name}")
+
+    journal = CompletionJournal(output_dir)
+    Render_Cached.reannotate_views(camera, views, journal, vertex_group_name, target_obj, output_dir)
+
+
+main()
@@ -1,8 +1,16 @@
 import bpy
 import csv
 import os
+import sys
 from datetime import datetime
-from mathutils import Vector
+
+# Make the helper modules next to this script importable from Blender
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.append(SCRIPT_DIR)
+
+from projection import project_vertices
+from visibility import classify_visibility
 
 # Define a global resolution
 RENDER_RESOLUTION_X = 1024
@@ -28,32 +36,6 @@ def save_viewport_snapshot(file_path):
     
     return bpy.context.scene.render.resolution_x, bpy.context.scene.render.resolution_y
 
-def world_space_to_screen_space(camera, world_point):
-    cam_obj = bpy.data.objects[camera]
-    scene = bpy.context.scene
-    from bpy_extras.object_utils import world_to_camera_view
-    co_2d = world_to_camera_view(scene, cam_obj, world_point)
-    render_scale = scene.render.resolution_percentage / 100
-    render_size = (
-        int(RENDER_RESOLUTION_X * render_scale),
-        int(RENDER_RESOLUTION_Y * render_scale),
-    )
-    return (co_2d.x * render_size[0], (1-co_2d.y) * render_size[1])
-
-def is_vertex_visible(camera, world_point, obj):
-    cam_obj = bpy.data.objects[camera]
-    origin = cam_obj.location
-    direction = (world_point - origin).normalized()
-
-    depsgraph = bpy.context.evaluated_depsgraph_get()
-    evaluated_obj = obj.evaluated_get(depsgraph)
-
-    # Perform ray casting
-    hit, location, normal, index, hit_obj, matrix = bpy.context.scene.ray_cast(depsgraph, origin, direction)
-
-    # Ensure the hit object is the evaluated version of the original object
-    return hit and hit_obj == evaluated_obj
-
 def write_vertices_to_csv(mesh_name, camera_name, file_path, image_path):
     configure_render_settings()
     directory = os.path.dirname(file_path)
@@ -65,17 +47,21 @@ def write_vertices_to_csv(mesh_name, camera_name, file_path, image_path):
         csvwriter.writerow(['Vertex Index', 'World X', 'World Y', 'World Z', 'Screen X', 'Screen Y', 'Visible', 'Width', 'Height', 'ScaleX', 'ScaleY'])
 
         mesh_obj = bpy.data.objects[mesh_name]
-        mesh_data = mesh_obj.data
+        cam_obj = bpy.data.objects[camera_name]
+
+        # Project all vertices at once, then only ray cast the ones the frustum and backface tests can't settle
+        world_cos, screen_positions, co_ndc = project_vertices(bpy.context.scene, cam_obj, mesh_obj)
+        indices = list(range(len(world_cos)))
+        visibility, stats = classify_visibility(cam_obj, mesh_obj, indices, world_cos, co_ndc)
+        print(f"Visibility stages: {stats}")
 
-        for i, v in enumerate(mesh_data.vertices):
-            world_co = mesh_obj.matrix_world @ v.co
-            screen_pos = world_space_to_screen_space(camera_name, world_co)
-            visible = 'Yes' if is_vertex_visible(camera_name, world_co, mesh_obj) else 'No'
+        for i, world_co, screen_pos, is_visible in zip(indices, world_cos.tolist(), screen_positions.tolist(), visibility.tolist()):
+            visible = 'Yes' if is_visible else 'No'
 
-            csvwriter.writerow([i, world_co.x, world_co.y, world_co.z, screen_pos[0], screen_pos[1], visible, RENDER_RESOLUTION_X, RENDER_RESOLUTION_Y, 1.0, 1.0])
+            csvwriter.writerow([i, world_co[0], world_co[1], world_co[2], screen_pos[0], screen_pos[1], visible, RENDER_RESOLUTION_X, RENDER_RESOLUTION_Y, 1.0, 1.0])
 
             if i % 1000 == 0:
-                print(i, world_co.x, world_co.y, world_co.z, screen_pos[0], screen_pos[1], visible)
+                print(i, world_co[0], world_co[1], world_co[2], screen_pos[0], screen_pos[1], visible)
 
     w, h = save_viewport_snapshot(image_path)
     print(f"Snapshot saved with dimensions {w}x{h}")
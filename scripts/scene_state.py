@@ -0,0 +1,68 @@
+def _same(a, b, tolerance):
+    """Compare two property values, element wise for sequences and within tolerance for numbers."""
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+        return abs(a - b) <= tolerance
+    return a == b
+
+
+class SceneState:
+    """Applies per-view scene parameters, only writing the ones that changed since the last view.
+
+    Every write through bpy tags the datablock for a depsgraph update, and
+    Cycles resyncs whatever was tagged, even when the value is the same. Each
+    parameter is registered with its setter. apply() compares the requested
+    values with the ones applied last, calls the setters of the changed ones,
+    and runs update (e.g. view_layer.update) once if any of them needs it.
+    Call invalidate() after changing the scene behind its back. With
+    diff=False every parameter is written on every apply, like without this class.
+    """
+
+    def __init__(self, update=None, tolerance=1e-7, diff=True):
+        self.update = update
+        self.tolerance = tolerance
+        self.diff = diff
+        self.setters = {}
+        self.needs_update = set()
+        self.applied = {}
+        self.stats = {'applies': 0, 'writes': 0, 'writes_skipped': 0, 'updates': 0, 'updates_skipped': 0}
+        self.change_counts = {}
+
+    def register(self, name, setter, needs_update=False):
+        """Add a parameter. needs_update marks parameters the caller reads back through the depsgraph."""
+        self.setters[name] = setter
+        if needs_update:
+            self.needs_update.add(name)
+        self.change_counts[name] = 0
+
+    def apply(self, **values):
+        """Apply the given parameters and return the names of the ones written, in the given order."""
+        changed = []
+        for name, value in values.items():
+            if self.diff and name in self.applied and _same(self.applied[name], value, self.tolerance):
+                self.stats['writes_skipped'] += 1
+                continue
+            self.setters[name](value)
+            self.applied[name] = value
+            self.change_counts[name] += 1
+            self.stats['writes'] += 1
+            changed.append(name)
+
+        self.stats['applies'] += 1
+        if self.update is not None and self.needs_update.intersection(values):
+            if self.needs_update.intersection(changed):
+                self.update()
+                self.stats['updates'] += 1
+            else:
+                self.stats['updates_skipped'] += 1
+        return changed
+
+    def invalidate(self, *names):
+        """Forget the applied values of the given parameters, or of all of them, so the next apply writes them."""
+        for name in names or list(self.applied):
+            self.applied.pop(name, None)
+
+    def summary(self):
+        """Return the counters and how often each parameter changed."""
+        return dict(self.stats, changes=dict(self.change_counts))
@@ -0,0 +1,222 @@
+import csv
+import glob
+import io
+import json
+import os
+import tarfile
+import time
+
+import numpy as np
+
+SHARD_PATTERN = 'shard-{:06d}.tar'
+INDEX_FILE = 'index.csv'
+INDEX_FIELDS = ['key', 'shard', 'offset', 'size']
+
+
+def encode_arrays(arrays):
+    """Pack a dict of NumPy arrays into .npz bytes."""
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_arrays(data):
+    """Unpack .npz bytes written by encode_arrays into a dict of arrays."""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def read_index(shard_dir):
+    """Return the index rows (key, shard, offset, size) of a shard directory."""
+    index_path = os.path.join(shard_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'r', newline='') as f:
+        lines = f.readlines()
+    # A crash while appending can leave a torn last row without its line end, which is skipped
+    if lines and not lines[-1].endswith('\n'):
+        lines.pop()
+    return [
+        {'key': row['key'], 'shard': row['shard'], 'offset': int(row['offset']), 'size': int(row['size'])}
+        for row in csv.DictReader(lines)
+    ]
+
+
+def _write_index(shard_dir, index):
+    """Write index.csv of a shard directory, replacing the old one atomically."""
+    index_path = os.path.join(shard_dir, INDEX_FILE)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+        writer.writeheader()
+        writer.writerows(index)
+    os.replace(tmp_path, index_path)
+
+
+def _shard_number(shard_name):
+    return int(shard_name[len('shard-'):-len('.tar')])
+
+
+def _next_shard_number(shard_dir):
+    """Return the number after the highest shard in a directory."""
+    names = [os.path.basename(path) for path in glob.glob(os.path.join(shard_dir, 'shard-*.tar'))]
+    return max(map(_shard_number, names), default=-1) + 1
+
+
+def _trim_shards(shard_dir, index):
+    """Cut bytes past the last indexed sample off each shard, left there by a crash in the middle of a write."""
+    ends = {}
+    for row in index:
+        ends[row['shard']] = max(ends.get(row['shard'], 0), row['offset'] + row['size'])
+    for shard_name, end in ends.items():
+        shard_path = os.path.join(shard_dir, shard_name)
+        if not os.path.exists(shard_path) or os.path.getsize(shard_path) <= end:
+            continue
+        with open(shard_path, 'r+b') as f:
+            f.seek(end)
+            # A closed shard ends in zero blocks, anything else is a torn sample
+            if f.read().strip(b'\0'):
+                f.truncate(end)
+
+
+class ShardWriter:
+    """Stream finished views into size capped sequential tar shards.
+
+    Each sample is stored as consecutive tar members sharing a key:
+    <key>.png (image bytes), <key>.npz (annotation arrays) and <key>.json
+    (camera / HDRI metadata). index.csv lists which shard and byte offset
+    each sample starts at. A row is appended as soon as a sample is written,
+    so the index covers everything a crash left behind, and the index is
+    rewritten atomically whenever a shard is closed. Reopening a directory
+    starts a new shard instead of appending.
+    """
+
+    def __init__(self, shard_dir, max_shard_bytes=512 * 1024 * 1024):
+        self.shard_dir = shard_dir
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(shard_dir, exist_ok=True)
+
+        self.index = read_index(shard_dir)
+        _trim_shards(shard_dir, self.index)
+        self.index_file = None
+        self.shard_number = _next_shard_number(shard_dir)
+        self.tar = None
+        self.shard_name = None
+
+    def _open_shard(self):
+        self.shard_name = SHARD_PATTERN.format(self.shard_number)
+        self.shard_number += 1
+        self.tar = tarfile.open(os.path.join(self.shard_dir, self.shard_name), 'w')
+
+    def _close_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+            self.write_index()
+
+    def write(self, key, image_bytes, annotation, metadata):
+        """Add one sample to the current shard, starting a new shard when it would exceed the size cap."""
+        members = [
+            (f'{key}.png', image_bytes),
+            (f'{key}.npz', encode_arrays(annotation)),
+            (f'{key}.json', json.dumps(metadata).encode('utf-8')),
+        ]
+        # Each member takes a 512 byte header plus its data padded to 512 bytes
+        sample_size = sum(512 + (len(data) + 511) // 512 * 512 for _, data in members)
+
+        if self.tar is not None and self.tar.offset > 0 and self.tar.offset + sample_size > self.max_shard_bytes:
+            self._close_shard()
+        if self.tar is None:
+            self._open_shard()
+
+        offset = self.tar.offset
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.tar.addfile(info, io.BytesIO(data))
+        self.tar.fileobj.flush()
+        # Record the bytes actually written, tarfile may add extended headers (e.g. for the float mtime)
+        row = {'key': key, 'shard': self.shard_name, 'offset': offset, 'size': self.tar.offset - offset}
+        self._append_index_row(row)
+        self.index.append(row)
+
+    def _append_index_row(self, row):
+        """Append one row to index.csv right away, so callers can record the sample as done once this returns."""
+        if self.index_file is None:
+            # Rewrite first, so the file ends on a full row after a crash
+            self.write_index()
+            self.index_file = open(os.path.join(self.shard_dir, INDEX_FILE), 'a', newline='')
+        csv.DictWriter(self.index_file, fieldnames=INDEX_FIELDS).writerow(row)
+        self.index_file.flush()
+
+    def write_index(self):
+        """Write index.csv next to the shards, replacing the old one atomically."""
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+        _write_index(self.shard_dir, self.index)
+
+    def close(self):
+        self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def merge_shards(source_dir, shard_dir):
+    """Move the shards of source_dir into shard_dir, numbered after the shards already there, and merge the indexes.
+
+    Offsets within a shard don't change, so only the shard names of the moved
+    index rows are rewritten. Returns the number of samples moved.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    index = read_index(shard_dir)
+    incoming = read_index(source_dir)
+    _trim_shards(source_dir, incoming)
+    next_number = _next_shard_number(shard_dir)
+
+    renamed = {}
+    for shard_name in sorted({row['shard'] for row in incoming}):
+        renamed[shard_name] = SHARD_PATTERN.format(next_number)
+        next_number += 1
+        os.replace(os.path.join(source_dir, shard_name), os.path.join(shard_dir, renamed[shard_name]))
+    index.extend(dict(row, shard=renamed[row['shard']]) for row in incoming)
+    _write_index(shard_dir, index)
+    return len(incoming)
+
+
+def iter_shard(shard_path):
+    """Yield the samples of one shard in order, reading the tar file front to back once."""
+    sample = None
+    with tarfile.open(shard_path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, ext = os.path.splitext(member.name)
+            data = tar.extractfile(member).read()
+            if sample is not None and sample['key'] != key:
+                yield sample
+                sample = None
+            if sample is None:
+                sample = {'key': key}
+            if ext == '.png':
+                sample['image'] = data
+            elif ext == '.npz':
+                sample['annotation'] = decode_arrays(data)
+            elif ext == '.json':
+                sample['metadata'] = json.loads(data)
+    if sample is not None:
+        yield sample
+
+
+def iter_samples(shard_dir):
+    """Yield every sample of a shard directory in write order, one sequential read per shard."""
+    shard_names = [row['shard'] for row in read_index(shard_dir)]
+    if not shard_names:
+        shard_names = [os.path.basename(path) for path in glob.glob(os.path.join(shard_dir, 'shard-*.tar'))]
+    for shard_name in sorted(set(shard_names)):
+        yield from iter_shard(os.path.join(shard_dir, shard_name))
@@ -0,0 +1,102 @@
+import hashlib
+
+import bpy
+import numpy as np
+
+from projection import matrix_to_array, transform_normals, transform_points
+
+# Modifier settings of these types are hashed by value, pointers by the name of what they point to
+HASHED_PROPERTY_TYPES = {'BOOLEAN', 'INT', 'FLOAT', 'STRING', 'ENUM'}
+
+
+def _hash_matrix(digest, matrix):
+    digest.update(matrix_to_array(matrix).tobytes())
+
+
+def _hash_properties(digest, struct):
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == 'rna_type':
+            continue
+        value = getattr(struct, prop.identifier, None)
+        if prop.type in HASHED_PROPERTY_TYPES:
+            digest.update(f'{prop.identifier}={value!r};'.encode())
+        elif prop.type == 'POINTER' and hasattr(value, 'name'):
+            digest.update(f'{prop.identifier}->{value.name};'.encode())
+
+
+def subject_fingerprint(mesh_obj):
+    """Hash everything that moves the evaluated vertices of mesh_obj between views.
+
+    That is its world matrix, its modifier stack and settings, the object
+    matrices and bone poses of the armatures it is deformed by, and its shape
+    key values. The camera and the world are not part of it.
+    """
+    digest = hashlib.sha1()
+    _hash_matrix(digest, mesh_obj.matrix_world)
+    digest.update(str(len(mesh_obj.data.vertices)).encode())
+
+    for modifier in mesh_obj.modifiers:
+        digest.update(f'{modifier.name}:{modifier.type};'.encode())
+        _hash_properties(digest, modifier)
+        armature = modifier.object if modifier.type == 'ARMATURE' else None
+        if armature is not None and armature.pose is not None:
+            _hash_matrix(digest, armature.matrix_world)
+            for bone in armature.pose.bones:
+                _hash_matrix(digest, bone.matrix)
+
+    shape_keys = mesh_obj.data.shape_keys
+    if shape_keys is not None:
+        for key_block in shape_keys.key_blocks:
+            digest.update(f'{key_block.name}={key_block.value!r}:{key_block.mute};'.encode())
+    return digest.hexdigest()
+
+
+class SubjectCache:
+    """World space vertex positions and normals of the evaluated subject mesh.
+
+    The arrays are only recomputed when subject_fingerprint() changes, so views
+    that just move the camera or swap the HDRI reuse them. If the modifiers
+    change the vertex count, vertex group indices no longer apply and the rest
+    mesh is used instead, like before the cache existed.
+    """
+
+    def __init__(self, mesh_obj):
+        self.mesh_obj = mesh_obj
+        self.fingerprint = None
+        self.world_co = None
+        self.world_normals = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """Return (world_co, world_normals) (N, 3) arrays over all vertices of the mesh."""
+        fingerprint = subject_fingerprint(self.mesh_obj)
+        if fingerprint == self.fingerprint:
+            self.hits += 1
+            return self.world_co, self.world_normals
+
+        self.misses += 1
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        obj_eval = self.mesh_obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+        try:
+            num_vertices = len(mesh.vertices)
+            if num_vertices != len(self.mesh_obj.data.vertices):
+                print(f"Modifiers of '{self.mesh_obj.name}' change its vertex count, annotating the rest mesh")
+                mesh, matrix_world = self.mesh_obj.data, self.mesh_obj.matrix_world
+            else:
+                matrix_world = obj_eval.matrix_world
+            local_co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+            mesh.vertices.foreach_get('co', local_co)
+            normals = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+            mesh.vertices.foreach_get('normal', normals)
+        finally:
+            obj_eval.to_mesh_clear()
+
+        self.world_co = transform_points(matrix_world, local_co.reshape(-1, 3))
+        self.world_normals = transform_normals(matrix_world, normals.reshape(-1, 3))
+        self.fingerprint = fingerprint
+        return self.world_co, self.world_normals
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class VertexGroupIndex:
+    """Vertex group membership of a mesh as compact index and weight arrays.
+
+    Membership does not change between views of the same subject, so the index
+    is built once per run and reused for every view.
+    """
+
+    def __init__(self, groups):
+        # Maps group name -> (uint32 vertex indices, float32 weights)
+        self.groups = groups
+
+    @classmethod
+    def from_mesh(cls, mesh_obj):
+        """Build the index with a single pass over the mesh vertices."""
+        group_names = {group.index: group.name for group in mesh_obj.vertex_groups}
+        members = {index: ([], []) for index in group_names}
+
+        for vert in mesh_obj.data.vertices:
+            for group in vert.groups:
+                if group.group in members:
+                    members[group.group][0].append(vert.index)
+                    members[group.group][1].append(group.weight)
+
+        groups = {}
+        for index, (indices, weights) in members.items():
+            groups[group_names[index]] = (np.array(indices, dtype=np.uint32), np.array(weights, dtype=np.float32))
+        return cls(groups)
+
+    def __contains__(self, group_name):
+        return group_name in self.groups
+
+    def indices(self, group_name):
+        """Return the vertex indices of a group."""
+        return self.groups[group_name][0]
+
+    def weights(self, group_name):
+        """Return the vertex weights of a group, aligned with indices()."""
+        return self.groups[group_name][1]
+
+    def union(self, group_names):
+        """Return (indices, mask) for the vertices in any of the groups, indices sorted.
+
+        Bit k of the uint64 mask is set for vertices in group_names[k], so up to 64 groups fit.
+        """
+        if len(group_names) > 64:
+            raise ValueError(f"A group mask holds at most 64 groups, got {len(group_names)}")
+        members = [self.indices(name) for name in group_names]
+        indices = np.unique(np.concatenate(members)) if members else np.empty(0, dtype=np.uint32)
+
+        mask = np.zeros(len(indices), dtype=np.uint64)
+        for bit, group_indices in enumerate(members):
+            mask[np.searchsorted(indices, group_indices)] |= np.uint64(1 << bit)
+        return indices.astype(np.uint32), mask
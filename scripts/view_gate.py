@@ -0,0 +1,60 @@
+import numpy as np
+
+from projection import project_vertices, mesh_world_normals
+from visibility import in_frustum
+
+
+def estimate_view_quality(scene, cam_obj, mesh_obj, indices, max_vertices=2000, backface_threshold=0.1,
+                          world_co=None, normals=None):
+    """Cheaply estimate how much of a vertex group a camera pose sees, without rendering or ray casts.
+
+    Returns (in_frame, visible): the fraction of the group inside the camera
+    frame, and the fraction that is inside the frame and faces the camera.
+    Occlusion by other parts of the mesh is ignored, so visible is an upper
+    bound. At most max_vertices evenly spread group vertices are tested.
+    world_co and normals are world space positions and unit normals aligned
+    with indices (e.g. of the evaluated mesh), read from the mesh if not given.
+    """
+    indices = np.asarray(indices)
+    if len(indices) == 0:
+        return 0.0, 0.0
+    if len(indices) > max_vertices:
+        picked = np.linspace(0, len(indices) - 1, max_vertices).astype(np.intp)
+        indices = indices[picked]
+        world_co = world_co[picked] if world_co is not None else None
+        normals = normals[picked] if normals is not None else None
+    if normals is None:
+        normals = mesh_world_normals(mesh_obj, indices)
+
+    world_co, _, co_ndc = project_vertices(scene, cam_obj, mesh_obj, indices, world_co)
+    framed = in_frustum(co_ndc, cam_obj.data.clip_start, cam_obj.data.clip_end)
+
+    view_dirs = world_co - np.array(cam_obj.matrix_world.translation, dtype=np.float64)
+    view_dirs /= np.maximum(np.linalg.norm(view_dirs, axis=1, keepdims=True), 1e-12)
+    facing = np.einsum('ij,ij->i', normals, view_dirs) <= backface_threshold
+    return float(framed.mean()), float((framed & facing).mean())
+
+
+class ViewGate:
+    """Accepts or rejects candidate camera poses by their estimated in-frame and visible fractions."""
+
+    def __init__(self, min_in_frame=0.5, min_visible=0.25):
+        self.min_in_frame = min_in_frame
+        self.min_visible = min_visible
+        self.stats = {'candidates': 0, 'accepted': 0, 'rejected_in_frame': 0, 'rejected_visible': 0}
+
+    def check(self, in_frame, visible):
+        """Count a candidate and return whether it passes the thresholds."""
+        self.stats['candidates'] += 1
+        if in_frame < self.min_in_frame:
+            self.stats['rejected_in_frame'] += 1
+            return False
+        if visible < self.min_visible:
+            self.stats['rejected_visible'] += 1
+            return False
+        self.stats['accepted'] += 1
+        return True
+
+    def summary(self):
+        """Return the thresholds and counts, e.g. to store with the view plan."""
+        return dict(self.stats, min_in_frame=self.min_in_frame, min_visible=self.min_visible)
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+PLAN_FILE = 'view_plan.json'
+JOURNAL_FILE = 'journal.jsonl'
+
+
+def write_atomic(file_path, text):
+    """Write a text file through a temporary file and swap it in, so readers never see a partial file."""
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def find_latest_run(subject_dir):
+    """Return the name of the most recent run folder that has a view plan, or None."""
+    if not os.path.isdir(subject_dir):
+        return None
+    runs = sorted(name for name in os.listdir(subject_dir) if os.path.exists(os.path.join(subject_dir, name, PLAN_FILE)))
+    return runs[-1] if runs else None
+
+
+class ViewPlan:
+    """Precomputed, seeded list of views for a run.
+
+    Each view is a dict with index, name, camera location and rotation, HDRI
+    path and background strength. The plan is written to the output
+    directory before rendering, so a restarted run renders exactly the same
+    views.
+    """
+
+    def __init__(self, views, seed=None, settings=None):
+        self.views = views
+        self.seed = seed
+        self.settings = settings or {}
+
+    @classmethod
+    def load(cls, output_dir):
+        with open(os.path.join(output_dir, PLAN_FILE), 'r') as f:
+            data = json.load(f)
+        return cls(data['views'], data.get('seed'), data.get('settings'))
+
+    @staticmethod
+    def exists(output_dir):
+        return os.path.exists(os.path.join(output_dir, PLAN_FILE))
+
+    def save(self, output_dir):
+        data = {'seed': self.seed, 'settings': self.settings, 'views': self.views}
+        write_atomic(os.path.join(output_dir, PLAN_FILE), json.dumps(data, indent=1))
+
+    def __len__(self):
+        return len(self.views)
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def __getitem__(self, index):
+        return self.views[index]
+
+
+def make_view(index, location, rotation, hdri_path, background_strength):
+    """Build a plan entry."""
+    return {
+        'index': index,
+        'name': f'view_{index:03}',
+        'location': [float(v) for v in location],
+        'rotation': [float(v) for v in rotation],
+        'hdri': hdri_path,
+        'strength': float(background_strength),
+    }
+
+
+class CompletionJournal:
+    """Append-only record of finished views.
+
+    Each record is appended as one JSON line and synced to disk before
+    record() returns. A crash can at most leave a torn last line, which is
+    ignored when the journal is read back.
+    """
+
+    def __init__(self, output_dir):
+        self.file_path = os.path.join(output_dir, JOURNAL_FILE)
+        self.records = []
+        if os.path.exists(self.file_path):
+            with open(self.file_path, 'r') as f:
+                lines = f.readlines()
+            torn = bool(lines) and not lines[-1].endswith('\n')
+            if torn:
+                lines.pop()
+            self.records = [json.loads(line) for line in lines if line.strip()]
+            if torn:
+                # Drop the torn line, so the next record doesn't get appended to it
+                self.save()
+
+    def completed(self):
+        """Return the indices of the views that have finished."""
+        return {record['index'] for record in self.records}
+
+    def record(self, view, **info):
+        """Mark a view as finished."""
+        record = {'index': view['index'], 'name': view['name'], 'finished_at': time.time()}
+        record.update(info)
+        self.records.append(record)
+        with open(self.file_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self):
+        """Rewrite the journal file with the current records, e.g. after merging another journal into them."""
+        write_atomic(self.file_path, ''.join(json.dumps(r) + '\n' for r in self.records))
+
+    def pending(self, plan):
+        """Return the plan views that still need rendering, in plan order."""
+        completed = self.completed()
+        return [view for view in plan if view['index'] not in completed]
@@ -0,0 +1,143 @@
+"""Camera viewpoint sampling on a spherical patch around the subject.
+
+Angles follow Camera.spherical_to_cartesian in camera_panning.py: theta is
+the polar angle from +Z and phi the azimuth from +X, both in radians.
+"""
+import math
+
+import numpy as np
+
+GOLDEN_RATIO_CONJUGATE = (math.sqrt(5) - 1) / 2
+# Number of reference directions the coverage metric is measured on
+COVERAGE_SAMPLES = 4096
+
+
+def spherical_to_cartesian(radius, theta, phi):
+    """Vectorized Camera.spherical_to_cartesian. Returns an (N, 3) array."""
+    sin_theta = np.sin(theta)
+    return np.column_stack((radius * sin_theta * np.cos(phi), radius * sin_theta * np.sin(phi), radius * np.cos(theta)))
+
+
+def _patch_cos_range(theta_range):
+    # Uniform in cos(theta) is uniform in area on the sphere
+    return math.cos(theta_range[1]), math.cos(theta_range[0])
+
+
+def fibonacci_directions(count, theta_range=(0, math.pi), phi_range=(-math.pi, math.pi), offset=0.0):
+    """Return (count, 2) arrays of (theta, phi) on a Fibonacci lattice over the patch.
+
+    Points are evenly spread by area, without the clumps of random sampling.
+    offset in [0, 1) rotates the lattice, so different seeds give different views.
+    """
+    i = np.arange(count, dtype=np.float64)
+    cos_low, cos_high = _patch_cos_range(theta_range)
+    cos_theta = cos_high - (i + 0.5) / count * (cos_high - cos_low)
+    phi = phi_range[0] + np.mod(i * GOLDEN_RATIO_CONJUGATE + offset, 1.0) * (phi_range[1] - phi_range[0])
+    return np.column_stack((np.arccos(np.clip(cos_theta, -1.0, 1.0)), phi))
+
+
+def random_directions(count, theta_range=(0, math.pi), phi_range=(-math.pi, math.pi), rng=None):
+    """Return (count, 2) arrays of (theta, phi) drawn uniformly by area over the patch."""
+    rng = rng or np.random.default_rng()
+    cos_low, cos_high = _patch_cos_range(theta_range)
+    theta = np.arccos(rng.uniform(cos_low, cos_high, count))
+    phi = rng.uniform(phi_range[0], phi_range[1], count)
+    return np.column_stack((theta, phi))
+
+
+def unit_vectors(directions):
+    return spherical_to_cartesian(1.0, directions[:, 0], directions[:, 1])
+
+
+def farthest_point_directions(count, theta_range=(0, math.pi), phi_range=(-math.pi, math.pi), rng=None, oversample=32):
+    """Greedy farthest point sampling of (theta, phi) from count * oversample random candidates.
+
+    Each pick is the candidate with the largest angle to every view picked so far.
+    """
+    rng = rng or np.random.default_rng()
+    candidates = random_directions(count * oversample, theta_range, phi_range, rng)
+    vectors = unit_vectors(candidates)
+
+    picked = np.empty(count, dtype=np.intp)
+    picked[0] = rng.integers(len(candidates))
+    # Cosine of the angle to the nearest picked view, larger means closer
+    nearest_cos = vectors @ vectors[picked[0]]
+    for k in range(1, count):
+        picked[k] = np.argmin(nearest_cos)
+        np.maximum(nearest_cos, vectors @ vectors[picked[k]], out=nearest_cos)
+    return candidates[picked]
+
+
+def stratified_radii(count, radius_range, rng=None):
+    """Return count radii with one in each of count equal slices of radius_range, in random order."""
+    rng = rng or np.random.default_rng()
+    strata = (rng.permutation(count) + rng.uniform(0.0, 1.0, count)) / count
+    return radius_range[0] + strata * (radius_range[1] - radius_range[0])
+
+
+def sample_viewpoints(count, mode='fibonacci', center=(0.0, 0.0, 0.0), radius_range=(1.5, 3.0),
+                      theta_range=(0, math.pi), phi_range=(-math.pi, math.pi), rng=None):
+    """Return (locations, directions): (count, 3) camera locations around center and their (theta, phi).
+
+    mode is 'fibonacci' or 'farthest'.
+    """
+    rng = rng or np.random.default_rng()
+    if mode == 'fibonacci':
+        directions = fibonacci_directions(count, theta_range, phi_range, rng.uniform())
+        # Shuffle, so any prefix of the plan (e.g. a queue batch) covers the whole patch evenly
+        directions = directions[rng.permutation(count)]
+    elif mode == 'farthest':
+        directions = farthest_point_directions(count, theta_range, phi_range, rng)
+    else:
+        raise ValueError(f"Unknown viewpoint mode '{mode}', use 'fibonacci' or 'farthest'")
+
+    radii = stratified_radii(count, radius_range, rng)
+    locations = spherical_to_cartesian(radii, directions[:, 0], directions[:, 1]) + np.asarray(center, dtype=np.float64)
+    return locations, directions
+
+
+def angular_coverage(view_vectors, theta_range=(0, math.pi), phi_range=(-math.pi, math.pi), coverage_angle=math.radians(10)):
+    """Measure how evenly view directions cover the patch.
+
+    view_vectors are (N, 3) offsets from the subject to the cameras. Returns
+    'coverage', the fraction of the patch within coverage_angle of some view,
+    and 'mean_gap_deg' / 'max_gap_deg', the mean and largest angle from a
+    point of the patch to its nearest view.
+    """
+    view_vectors = np.asarray(view_vectors, dtype=np.float64)
+    view_vectors = view_vectors / np.linalg.norm(view_vectors, axis=1, keepdims=True)
+    reference = unit_vectors(fibonacci_directions(COVERAGE_SAMPLES, theta_range, phi_range))
+
+    nearest_cos = np.full(len(reference), -1.0)
+    # In chunks, so thousands of views don't need a huge distance matrix
+    for start in range(0, len(view_vectors), 256):
+        np.maximum(nearest_cos, (reference @ view_vectors[start:start + 256].T).max(axis=1), out=nearest_cos)
+    gaps = np.degrees(np.arccos(np.clip(nearest_cos, -1.0, 1.0)))
+
+    return {
+        'coverage': float((gaps <= math.degrees(coverage_angle)).mean()),
+        'mean_gap_deg': float(gaps.mean()),
+        'max_gap_deg': float(gaps.max()),
+    }
+
+
+def count_for_coverage(target, mode='fibonacci', theta_range=(0, math.pi), phi_range=(-math.pi, math.pi),
+                       coverage_angle=math.radians(10), max_count=4096, seed=0):
+    """Return the smallest number of views (up to max_count) whose sampling reaches the target coverage."""
+    def reaches(count):
+        _, directions = sample_viewpoints(count, mode, theta_range=theta_range, phi_range=phi_range,
+                                          rng=np.random.default_rng(seed))
+        return angular_coverage(unit_vectors(directions), theta_range, phi_range, coverage_angle)['coverage'] >= target
+
+    low, high = 1, 1
+    while not reaches(high):
+        if high >= max_count:
+            return None
+        low, high = high + 1, min(high * 2, max_count)
+    while low < high:
+        middle = (low + high) // 2
+        if reaches(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return high
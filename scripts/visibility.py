@@ -0,0 +1,175 @@
+import bpy
+import numpy as np
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+
+from projection import mesh_world_normals
+
+VIEWER_IMAGE_NAME = 'Viewer Node'
+
+
+def connect_viewer(scene, output_name, use_alpha=False):
+    """Route a Render Layers output to the compositor Viewer node so it can be read back after a render."""
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    nodes = tree.nodes
+
+    render_layers = next((node for node in nodes if node.type == 'R_LAYERS'), None)
+    if render_layers is None:
+        render_layers = nodes.new(type='CompositorNodeRLayers')
+        render_layers.location = (-300, 0)
+
+    # Keep the rendered image going to the Composite output so the PNG is unchanged
+    composite = next((node for node in nodes if node.type == 'COMPOSITE'), None)
+    if composite is None:
+        composite = nodes.new(type='CompositorNodeComposite')
+        composite.location = (200, 100)
+    if not composite.inputs['Image'].is_linked:
+        tree.links.new(render_layers.outputs['Image'], composite.inputs['Image'])
+
+    viewer = next((node for node in nodes if node.type == 'VIEWER'), None)
+    if viewer is None:
+        viewer = nodes.new(type='CompositorNodeViewer')
+        viewer.location = (200, -100)
+    viewer.use_alpha = use_alpha
+    tree.links.new(render_layers.outputs[output_name], viewer.inputs['Image'])
+
+
+def read_viewer_pixels():
+    """Return the Viewer node image of the last render as an (height, width, 4) float32 array.
+
+    Rows start at the bottom of the image, the same way camera view y does.
+    """
+    viewer_image = bpy.data.images.get(VIEWER_IMAGE_NAME)
+    if viewer_image is None:
+        raise RuntimeError("No viewer image found, connect a Viewer node before rendering")
+
+    width, height = viewer_image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    viewer_image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, 4)
+
+
+def enable_depth_pass(scene):
+    """Turn on the Z pass and route it to a Viewer node so it can be read back after a render."""
+    bpy.context.view_layer.use_pass_z = True
+    connect_viewer(scene, 'Depth')
+
+
+def read_depth_buffer():
+    """Return the depth pass of the last render as an (height, width) float32 array."""
+    return read_viewer_pixels()[:, :, 0].copy()
+
+
+def in_frustum(co_ndc, clip_start, clip_end):
+    """Vectorized version of the frame and clip test done in vertex_visibility."""
+    return (
+        (co_ndc[:, 0] > 0.0) & (co_ndc[:, 0] < 1.0)
+        & (co_ndc[:, 1] > 0.0) & (co_ndc[:, 1] < 1.0)
+        & (co_ndc[:, 2] > clip_start) & (co_ndc[:, 2] < clip_end)
+    )
+
+
+def depth_visibility(co_ndc, depth, clip_start, clip_end, tolerance=0.01):
+    """Mark vertices visible when their camera depth matches the rendered depth at their pixel.
+
+    co_ndc comes from world_to_camera_view_array, so its z is the same
+    distance along the view axis that Cycles writes to the Z pass.
+    """
+    height, width = depth.shape
+    visible = in_frustum(co_ndc, clip_start, clip_end)
+
+    candidates = np.flatnonzero(visible)
+    px = np.minimum((co_ndc[candidates, 0] * width).astype(np.intp), width - 1)
+    py = np.minimum((co_ndc[candidates, 1] * height).astype(np.intp), height - 1)
+    rendered_depth = depth[py, px]
+
+    # Anything rendered in front of the vertex by more than the tolerance hides it
+    visible[candidates] = co_ndc[candidates, 2] - rendered_depth <= tolerance
+    return visible
+
+
+def find_occluders(names):
+    """Return the objects named in names, raising ValueError for any that don't exist."""
+    missing = [name for name in names if bpy.data.objects.get(name) is None]
+    if missing:
+        raise ValueError(f"Occluder objects not found: {', '.join(missing)}. Check OCCLUDER_NAMES.")
+    return [bpy.data.objects[name] for name in names]
+
+
+def build_occluder_trees(objects, depsgraph):
+    """Build one BVHTree per occluding object from its evaluated mesh.
+
+    Each entry is (tree, world matrix, inverse world matrix), since the trees
+    are in object space.
+    """
+    trees = []
+    for obj in objects:
+        if obj is None or obj.type != 'MESH':
+            continue
+        tree = BVHTree.FromObject(obj, depsgraph)
+        matrix_world = obj.evaluated_get(depsgraph).matrix_world.copy()
+        trees.append((tree, matrix_world, matrix_world.inverted()))
+    return trees
+
+
+def ray_cast_trees(trees, origin, target):
+    """Cast a ray from origin towards target and return the nearest world space hit, or None."""
+    nearest_hit = None
+    nearest_distance = float('inf')
+    for tree, matrix_world, matrix_inv in trees:
+        local_origin = matrix_inv @ origin
+        local_direction = (matrix_inv @ target) - local_origin
+        location, _, _, _ = tree.ray_cast(local_origin, local_direction.normalized())
+        if location is None:
+            continue
+        world_location = matrix_world @ location
+        distance = (world_location - origin).length
+        if distance < nearest_distance:
+            nearest_hit, nearest_distance = world_location, distance
+    return nearest_hit
+
+
+def classify_visibility(cam, mesh_obj, indices, world_co, co_ndc, occluders=None, trees=None,
+                        backface_threshold=0.1, hit_tolerance=0.01, normals=None):
+    """Classify vertex visibility in stages so only ambiguous vertices need a ray cast.
+
+    1. Frame and clip test on the projected coordinates (vectorized).
+    2. Cull vertices whose normal points away from the camera by more than backface_threshold (vectorized).
+    3. Ray cast the rest against BVH trees of the occluders, built once per call unless trees is given.
+
+    A ray cast vertex is visible when nothing is hit, or the hit is within hit_tolerance
+    of the vertex, like vertex_visibility. Returns (visible array, per-stage counts).
+    normals are world space unit normals aligned with indices, read from the mesh if not given.
+    """
+    visible = in_frustum(co_ndc, cam.data.clip_start, cam.data.clip_end)
+    stats = {'vertices': len(world_co), 'in_frustum': int(visible.sum())}
+
+    cam_location = np.array(cam.matrix_world.translation, dtype=np.float64)
+    candidates = np.flatnonzero(visible)
+    if len(candidates):
+        view_dirs = world_co[candidates] - cam_location
+        view_dirs /= np.maximum(np.linalg.norm(view_dirs, axis=1, keepdims=True), 1e-12)
+        if normals is not None:
+            candidate_normals = normals[candidates]
+        else:
+            candidate_normals = mesh_world_normals(mesh_obj, np.asarray(indices)[candidates])
+        facing_away = np.einsum('ij,ij->i', candidate_normals, view_dirs) > backface_threshold
+        visible[candidates[facing_away]] = False
+        candidates = candidates[~facing_away]
+    stats['front_facing'] = len(candidates)
+
+    if len(candidates):
+        if trees is None:
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            trees = build_occluder_trees(occluders or [mesh_obj], depsgraph)
+        origin = Vector(cam_location)
+        for i in candidates.tolist():
+            target = Vector(world_co[i])
+            hit = ray_cast_trees(trees, origin, target)
+            visible[i] = hit is None or (hit - target).length < hit_tolerance
+    stats['ray_casts'] = len(candidates)
+    stats['ray_casts_saved'] = stats['vertices'] - stats['ray_casts']
+    stats['visible'] = int(visible.sum())
+    return visible, stats